@@ -0,0 +1,160 @@
+"""Run the check-in pipeline over a data set from the command line, without the Streamlit UI.
+
+The input is either a directory of recordings, each transcribed and then analyzed, or a JSONL
+file of texts, one {"id": ..., "text": ...} object per line (`id` defaults to the line number).
+Each item gets one JSON line in the output with its transcript, score, band, factors, facts
+and guidance, or an "error". The output doubles as the checkpoint: run the same command again
+and items already in it are skipped, so an interrupted back-fill picks up where it stopped.
+An item that is redone gets a new line appended, and the last line for an id is the one that
+counts. With an API key, an item the assistant did not answer (its analysis or follow-ups came
+from the local fallbacks) is written as an error, so --retry-errors redoes it later.
+
+    GEMINI_API_KEY=... python batch.py recordings/ -o results.jsonl --workers 8 --rate 5
+    python batch.py texts.jsonl -o results.jsonl --followups
+    python batch.py texts.jsonl -o results.jsonl --retry-errors   # redo the items that failed
+
+Without an API key, texts are scored by the local lexicon scorer and recordings cannot be
+processed.
+"""
+import argparse
+import concurrent.futures
+import json
+import mimetypes
+import os
+import sys
+
+import streamlit.config
+import streamlit.logger
+
+# Every st.* call outside `streamlit run` logs a warning; nothing here renders anything.
+# Streamlit applies its configured log level when it first reads its config, so that is done
+# first, and all before importing the app so the warnings its import triggers are quieted too.
+streamlit.config.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+import stress_core  # noqa: E402
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a", ".webm", ".aac"}
+
+
+def read_items(path):
+    """Yield (id, kind, payload): ("audio", file path) per recording, or ("text", text) per JSONL line."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    full = os.path.join(root, name)
+                    yield os.path.relpath(full, path), "audio", full
+        return
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                record = json.loads(line)
+                yield str(record.get("id", line_no)), "text", record.get("text", "")
+
+
+def read_checkpoint(path, retry_errors):
+    """Ids already in the output file (only the successful ones with `retry_errors`).
+
+    An id's last line wins, so an item that failed and was then redone counts as done.
+    """
+    failed = {}  # id -> whether its latest line is an error
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by an interrupted run; that item is redone.
+                failed[record["id"]] = "error" in record
+    return {item_id for item_id, error in failed.items() if not (retry_errors and error)}
+
+
+def process(assistant, item_id, kind, payload, followups):
+    """Run one item through the pipeline and return its output record. Raises on failure.
+
+    With the assistant online, a local fallback in place of its answer is a failure too, so
+    the item is checkpointed as an error and can be retried instead of kept as a stand-in.
+    """
+    record = {"id": item_id}
+    if kind == "audio":
+        mime_type = mimetypes.guess_type(payload)[0] or "audio/wav"
+        with open(payload, "rb") as f:
+            text = assistant._transcribe(f.read(), mime_type)
+        record["transcript"] = text
+    else:
+        text = payload
+    if followups:
+        record["followups"] = assistant.followup_questions(text)
+        if assistant.client and tuple(record["followups"]) == stress_core.FALLBACK_QUESTIONS:
+            raise RuntimeError("The assistant did not answer; the follow-ups fell back to the defaults.")
+    result = assistant.analyze_text(text, deadline_s=None)
+    if assistant.client and result["source"] != "assistant":
+        raise RuntimeError(f"The assistant did not answer; the analysis came from the {result['source']} fallback.")
+    record.update(
+        score=result["score"],
+        band=stress_core.band_for_score(result["score"]),
+        factors=[{"label": label, "detail": detail} for label, detail in result["factors"]],
+        facts=result["facts"],
+        observations=result["observations"],
+        recommendation=result["recommendation"],
+        analysis_source=result["source"],
+    )
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory of recordings, or JSONL of texts")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file, appended to and resumed from")
+    parser.add_argument("--workers", type=int, default=8, help="items processed concurrently")
+    parser.add_argument("--rate", type=float, default=stress_core.GEMINI_RATE_PER_S, help="model requests per second")
+    parser.add_argument("--followups", action="store_true", help="also generate follow-up questions per item")
+    parser.add_argument("--retry-errors", action="store_true", help="redo items whose earlier attempt failed")
+    args = parser.parse_args()
+
+    assistant = stress_core.StressAssistant()
+    # A gate of our own: this process's rate and concurrency are the ones given here.
+    assistant.gate = stress_core.ModelCallGate(rate=args.rate, burst=max(1, int(args.rate)), max_in_flight=args.workers)
+    done = read_checkpoint(args.output, args.retry_errors)
+    items = ((i, kind, payload) for i, kind, payload in read_items(args.input) if i not in done)
+
+    processed = failed = 0
+    with open(args.output, "a", encoding="utf-8") as out, \
+            concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        pending = {}
+
+        def drain(block):
+            nonlocal processed, failed
+            until = concurrent.futures.FIRST_COMPLETED if block else concurrent.futures.ALL_COMPLETED
+            ready, _ = concurrent.futures.wait(pending, return_when=until)
+            for future in ready:
+                item_id = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"id": item_id, "error": f"{type(e).__name__}: {e}"}
+                    failed += 1
+                processed += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()  # Each finished item is checkpointed as soon as it is written.
+
+        for item_id, kind, payload in items:
+            if kind == "audio" and not assistant.client:
+                sys.exit("Recordings need the assistant: set GEMINI_API_KEY.")
+            pending[pool.submit(process, assistant, item_id, kind, payload, args.followups)] = item_id
+            # Keep a bounded window of submitted items, so huge inputs are streamed, not loaded.
+            if len(pending) >= args.workers * 4:
+                drain(block=True)
+        if pending:
+            drain(block=False)
+
+    usage = assistant.usage.totals("process")
+    print(f"{processed} processed ({failed} failed), {len(done)} already done; results in {args.output}",
+          file=sys.stderr)
+    print(f"{usage['calls']} model calls, {usage['prompt_tokens']} prompt and {usage['output_tokens']} output tokens "
+          f"({usage['audio_tokens']} audio), {usage['request_bytes'] / 2**20:.1f} MB sent", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare the "pipeline" and "multimodal" analysis modes on real recordings.
+
+Runs the full check-in (intake, then analysis) once per mode and repeat, against the live
+Gemini API, and reports wall time, request count and token usage for each mode:
+
+    GEMINI_API_KEY=... python benchmarks/analysis_modes.py initial.wav answer1.wav answer2.wav
+
+The first file is the initial reflection; the rest are follow-up answers, matched to the
+generated questions in order.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stress_core  # noqa: E402
+
+
+class UsageMeter:
+    """Wraps a client's generate calls to count requests and sum the reported token usage."""
+
+    def __init__(self, client):
+        self.requests = 0
+        self.tokens = {"prompt": 0, "output": 0}
+        models = client.models
+        plain, streamed = models.generate_content, models.generate_content_stream
+
+        def generate_content(*args, **kwargs):
+            resp = plain(*args, **kwargs)
+            self._count(resp.usage_metadata)
+            return resp
+
+        def generate_content_stream(*args, **kwargs):
+            usage = None
+            for chunk in streamed(*args, **kwargs):
+                usage = chunk.usage_metadata or usage
+                yield chunk
+            self._count(usage)
+
+        models.generate_content = generate_content
+        models.generate_content_stream = generate_content_stream
+
+    def _count(self, usage):
+        self.requests += 1
+        if usage is not None:
+            self.tokens["prompt"] += usage.prompt_token_count or 0
+            self.tokens["output"] += usage.candidates_token_count or 0
+
+
+def check_in(assistant, initial, answers):
+    if assistant.multimodal:
+        text, questions = assistant.ask_from_recording(initial)
+    else:
+        text = assistant.transcribe(initial)
+        questions = assistant.followup_questions(text)
+    clips = (answers + [None] * len(questions))[:len(questions)]
+    if assistant.multimodal:
+        assistant.analyze_recordings(text, questions, clips)
+    else:
+        replies = assistant.transcribe_many(clips)
+        assistant.analyze_text(stress_core.combine_answers(text, questions, replies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("initial", help="WAV of the initial reflection")
+    parser.add_argument("answers", nargs="*", help="WAVs answering the follow-up questions, in order")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    initial = open(args.initial, "rb").read()
+    answers = [open(path, "rb").read() for path in args.answers]
+
+    print(f"{'mode':<12}{'median s':>10}{'requests':>10}{'prompt tok':>12}{'output tok':>12}")
+    for mode in ("pipeline", "multimodal"):
+        stress_core.ANALYSIS_MODE = mode
+        assistant = stress_core.StressAssistant()
+        if not assistant.client:
+            sys.exit("Needs GEMINI_API_KEY to be set.")
+        # Without this, every pipeline repeat after the first is answered from the response and
+        # transcript caches, and the modes would be compared on cache lookups.
+        assistant.responses = stress_core.ResponseCache(stress_core.RESPONSE_CACHE_TTL_S, 0)
+        assistant.transcripts = stress_core.TranscriptCache(
+            stress_core.LRUCache(max_entries=0), stress_core.LRUCache(max_entries=0))
+        meter = UsageMeter(assistant.client)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            check_in(assistant, initial, answers)
+            times.append(time.perf_counter() - start)
+        # Each StressAssistant shares the pooled client, so unwrap before the next mode.
+        assistant.client.models.__dict__.pop("generate_content", None)
+        assistant.client.models.__dict__.pop("generate_content_stream", None)
+        n = args.repeat
+        print(f"{mode:<12}{statistics.median(times):>10.2f}{meter.requests / n:>10.1f}"
+              f"{meter.tokens['prompt'] / n:>12.0f}{meter.tokens['output'] / n:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark the audio preprocessing stage that runs before transcription.
+
+Reports upload size, audio duration (Gemini bills ~32 audio tokens per second) and
+preprocessing time for the raw recording versus each upload codec. With --live and a
+GEMINI_API_KEY, it also times end-to-end transcription of the raw and preprocessed audio.
+
+    python benchmarks/audio_preprocessing.py                 # synthetic 12 s recording
+    python benchmarks/audio_preprocessing.py clip1.wav ...   # your own recordings
+    python benchmarks/audio_preprocessing.py --live --repeat 3 clip.wav
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stress_core  # noqa: E402
+
+AUDIO_TOKENS_PER_SECOND = 32
+
+
+def synthetic_recording(rate=48000, seconds=12.0, lead=1.5, tail=2.5):
+    """A browser-like 48 kHz 16-bit WAV: room noise, then voiced, syllable-modulated harmonics."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(rate * seconds)) / rate
+    pitch = 140 + 25 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    speaking = (t >= lead) & (t <= seconds - tail)
+    signal = 0.25 * voice * syllables * speaking + 0.002 * rng.standard_normal(t.size)
+    buf = io.BytesIO()
+    sf.write(buf, signal.astype(np.float32), rate, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def duration(audio_bytes):
+    info = sf.info(io.BytesIO(audio_bytes))
+    return info.frames / info.samplerate
+
+
+def time_ms(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        runs.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="WAV recordings (default: a synthetic one)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per measurement (median reported)")
+    parser.add_argument("--live", action="store_true", help="also time real Gemini transcription")
+    args = parser.parse_args()
+
+    clips = [(path, open(path, "rb").read()) for path in args.files] or [("synthetic", synthetic_recording())]
+    assistant = None
+    if args.live:
+        assistant = stress_core.StressAssistant()
+        if not assistant.client:
+            sys.exit("--live needs GEMINI_API_KEY to be set.")
+        # Keyed on the raw recording, the transcript cache would answer every repeat and codec
+        # after the first call; keep nothing, so each timing is a real request.
+        assistant.transcripts = stress_core.TranscriptCache(
+            stress_core.LRUCache(max_entries=0), stress_core.LRUCache(max_entries=0))
+
+    print(f"{'clip':<16}{'variant':<10}{'bytes':>10}{'ratio':>8}{'seconds':>9}{'tokens':>8}"
+          f"{'prep ms':>9}{'e2e ms':>9}")
+    for name, raw in clips:
+        variants = [("raw", raw, "audio/wav", 0.0)]
+        for codec in stress_core.UPLOAD_CODECS:
+            stress_core.AUDIO_UPLOAD_CODEC = codec
+            (data, mime), prep_ms = time_ms(lambda: stress_core.preprocess_audio(raw), args.repeat)
+            variants.append((codec, data, mime, prep_ms))
+
+        for label, data, mime, prep_ms in variants:
+            seconds = duration(data)
+            e2e = ""
+            if assistant:
+                # The same call the app makes, preprocessing included (or skipped for "raw").
+                stress_core.AUDIO_PREPROCESSING = label != "raw"
+                stress_core.AUDIO_UPLOAD_CODEC = label
+                _, e2e_ms = time_ms(lambda: assistant._transcribe(raw), args.repeat)
+                e2e = f"{e2e_ms:9.0f}"
+            print(f"{name[:15]:<16}{label:<10}{len(data):>10}{len(raw) / len(data):>7.1f}x{seconds:>9.2f}"
+                  f"{seconds * AUDIO_TOKENS_PER_SECOND:>8.0f}{prep_ms:>9.1f}{e2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Check compute_stress_index_batch against compute_stress_index, then time both.
+
+The equivalence check is property-based: it draws random valid intakes (plus the boundary
+values where a factor or band flips) and requires identical scores, bands, factors and
+facts for every one, exiting non-zero on the first mismatch. The benchmark then scores the same
+cohort with a Python loop over the scalar function and with the batch function, and
+times per-intake rule evaluation with the shipped rule table and with one padded by
+extra rules, which should cost about the same.
+
+    python benchmarks/batch_scoring.py                 # 20k-case check, 200k-row benchmark
+    python benchmarks/batch_scoring.py --cases 100000 --rows 1000000 --seed 7
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stress_core  # noqa: E402
+
+EDGE_SLEEP = [0, 0.5, 6, 6.5, 6.99, 7, 7.5, 12]
+EDGE_EXERCISE = [0, 1, 2, 3, 7]
+
+
+def random_intake(rng):
+    return {
+        "stress_now": rng.randint(0, 10),
+        "sleep_hours": rng.choice(EDGE_SLEEP) if rng.random() < 0.3 else round(rng.uniform(0, 12), 1),
+        "control": rng.choice(stress_core.CONTROL_OPTIONS),
+        "energy": rng.choice(["Low", "Moderate", "High"]),
+        "symptoms": rng.sample(stress_core.SYMPTOM_OPTIONS, rng.randint(0, len(stress_core.SYMPTOM_OPTIONS))),
+        "exercise_days": rng.choice(EDGE_EXERCISE) if rng.random() < 0.3 else rng.randint(0, 7),
+        "stressor": rng.choice(stress_core.STRESSOR_OPTIONS),
+    }
+
+
+def columns(intakes):
+    return {field: [intake[field] for intake in intakes] for field in intakes[0]}
+
+
+def check_equivalence(intakes):
+    batch = stress_core.compute_stress_index_batch(columns(intakes))
+    for i, intake in enumerate(intakes):
+        score, band, factors = stress_core.compute_stress_index(intake)
+        labels = [stress_core.FACTOR_LABELS[bit] for bit in range(len(stress_core.FACTOR_LABELS))
+                  if batch["factors"][i] >> bit & 1]
+        if (score, band, [label for label, _ in factors]) != (batch["score"][i], batch["band"][i], labels):
+            sys.exit(f"Mismatch on {intake}:\n  scalar {score} {band} {factors}\n"
+                     f"  batch  {batch['score'][i]} {batch['band'][i]} {labels}")
+        facts = [text for bit, text in enumerate(stress_core.FACT_TEXTS) if batch["facts"][i] >> bit & 1]
+        if stress_core.select_stress_facts(intake) != facts[:stress_core.MAX_FACTS]:
+            sys.exit(f"Fact mismatch on {intake}:\n  scalar {stress_core.select_stress_facts(intake)}\n"
+                     f"  batch  {facts[:stress_core.MAX_FACTS]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=20_000, help="random intakes in the equivalence check")
+    parser.add_argument("--rows", type=int, default=200_000, help="cohort size for the benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    check_equivalence([random_intake(rng) for _ in range(args.cases)])
+    print(f"equivalence: {args.cases} random intakes identical")
+
+    cohort = [random_intake(rng) for _ in range(args.rows)]
+    start = time.perf_counter()
+    for intake in cohort:
+        stress_core.compute_stress_index(intake)
+    loop_s = time.perf_counter() - start
+
+    cols = columns(cohort)
+    start = time.perf_counter()
+    stress_core.compute_stress_index_batch(cols)
+    batch_s = time.perf_counter() - start
+
+    # The structured-array form, with categories and symptoms pre-encoded as integer codes.
+    table = np.zeros(args.rows, dtype=[("stress_now", "i1"), ("sleep_hours", "f8"), ("control", "i1"),
+                                       ("energy", "i1"), ("symptoms", "i2"), ("exercise_days", "i1"),
+                                       ("stressor", "i1")])
+    table["stress_now"], table["sleep_hours"], table["exercise_days"] = (
+        cols["stress_now"], cols["sleep_hours"], cols["exercise_days"])
+    table["control"] = [stress_core.CONTROL_OPTIONS.index(c) for c in cols["control"]]
+    table["energy"] = [stress_core.ENERGY_LEVELS.index(e) for e in cols["energy"]]
+    table["stressor"] = [stress_core.STRESSOR_OPTIONS.index(s) for s in cols["stressor"]]
+    table["symptoms"] = [stress_core.symptom_mask(s) for s in cols["symptoms"]]
+    start = time.perf_counter()
+    encoded = stress_core.compute_stress_index_batch(table)
+    encoded_s = time.perf_counter() - start
+    if not np.array_equal(encoded["score"], stress_core.compute_stress_index_batch(cols)["score"]):
+        sys.exit("Structured-array scores differ from the columnar scores.")
+
+    print(f"{'rows':>10}{'python loop s':>15}{'batch s':>10}{'(speedup)':>11}{'encoded s':>11}{'(speedup)':>11}")
+    print(f"{args.rows:>10}{loop_s:>15.3f}{batch_s:>10.3f}{loop_s / batch_s:>10.1f}x"
+          f"{encoded_s:>11.3f}{loop_s / encoded_s:>10.1f}x")
+    time_rule_scaling(cohort[:50_000])
+
+
+def time_rule_scaling(cohort, extra_rules=200):
+    """Per-intake RuleIndex.mask cost with STRESS_RULES alone and with `extra_rules` more."""
+    padded = stress_core.STRESS_RULES + tuple(
+        stress_core.Rule("fact", "sleep_hours", "<", 3 + i / extra_rules, f"Padding rule {i}.")
+        for i in range(extra_rules)
+    )
+    timings = []
+    for index in (stress_core.RULE_INDEX, stress_core.RuleIndex(padded)):
+        start = time.perf_counter()
+        for intake in cohort:
+            index.mask(intake)
+        timings.append((time.perf_counter() - start) / len(cohort) * 1e6)
+    print(f"rule evaluation: {len(stress_core.STRESS_RULES)} rules {timings[0]:.2f} us/intake, "
+          f"{len(padded)} rules {timings[1]:.2f} us/intake")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Time the whole check-in flow through main(), with local stand-ins for Gemini and gTTS.
+
+Drives the app headlessly with Streamlit's AppTest: log in, record a reflection, get the
+follow-up questions (with their speech), record two answers, analyze, and render the results.
+genai.Client, gTTS and st.audio_input are replaced with local fakes, so the numbers measure
+the app's own cost plus a fixed, configurable backend latency, and need no network or key.
+Every iteration starts cold: process caches are cleared and the speech cache gets a fresh
+directory.
+
+Reported per stage (median over --repeat):
+
+    login          the login rerun
+    intake         Continue on the first recording, end to end
+    followups      model time generating the follow-up questions
+    tts            synthesis time across all clips (runs overlapped with other work)
+    transcription  model time transcribing recordings (plus preprocessing, in intake/analysis)
+    analysis       Analyze My Stress, end to end
+    results        the rerun that renders the finished results
+    rerun          an idle rerun on the results page (mean of several)
+
+Medians are compared with the stored baseline for the same settings; a stage slower than
+the baseline by more than --tolerance fails the run (exit status 1):
+
+    python benchmarks/end_to_end.py                    # compare with the baseline
+    python benchmarks/end_to_end.py --save-baseline    # record a new baseline
+    python benchmarks/end_to_end.py --model-latency 1.5 --tts-latency 0.4 --mode multimodal
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+import streamlit
+from google import genai
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stress.py")
+sys.path.insert(0, os.path.dirname(APP))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "end_to_end.json")
+IDLE_RERUNS = 5
+NOISE_FLOOR_S = 0.05  # AppTest's own rerun jitter; smaller slowdowns are not flagged.
+STAGES = ("login", "intake", "followups", "tts", "transcription", "analysis", "results", "rerun")
+ANALYSIS = {
+    "score": 62,
+    "factors": [{"label": "Work pressure", "detail": "Deadlines are stacking up."},
+                {"label": "Short sleep", "detail": "You mentioned sleeping badly."}],
+    "facts": ["Short, regular breaks reduce how much stress builds up."],
+    "observations": "You are carrying a lot at work right now.",
+    "recommendation": "Take a ten minute walk after lunch. Write tomorrow's top task down tonight.",
+}
+
+
+class Timings:
+    """Thread-safe tally of the time the fakes spend, by kind."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.totals[kind] = self.totals.get(kind, 0.0) + seconds
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FakeModels:
+    """generate_content / generate_content_stream answering like Gemini does for each prompt."""
+
+    def __init__(self, latency, timings):
+        self.latency = latency
+        self.timings = timings
+
+    @staticmethod
+    def _reply(contents, config):
+        system = getattr(config, "system_instruction", None) or ""
+        if '"transcript"' in system:
+            return "followups", json.dumps({"transcript": "Work has been relentless and I sleep badly.",
+                                            "questions": ["What feels most urgent?", "Who could help?"]})
+        if '"answers"' in system:
+            return "analysis", json.dumps({"answers": ["The deadline on Friday.", "My manager, maybe."],
+                                           **ANALYSIS})
+        if isinstance(contents, list):
+            return "transcription", "Work has been relentless lately and I have been sleeping badly."
+        if "questions" in system:
+            return "followups", json.dumps({"questions": ["What feels most urgent?", "Who could help?"]})
+        return "analysis", json.dumps(ANALYSIS)
+
+    def generate_content(self, model=None, contents=None, config=None, **_):
+        start = time.perf_counter()
+        kind, text = self._reply(contents, config)
+        time.sleep(self.latency)
+        self.timings.add(kind, time.perf_counter() - start)
+        return FakeResponse(text)
+
+    def generate_content_stream(self, model=None, contents=None, config=None, **_):
+        start = time.perf_counter()
+        kind, text = self._reply(contents, config)
+        # Half the latency to the first chunk, the rest spread over the remaining chunks.
+        time.sleep(self.latency / 2)
+        chunks = [text[i:i + 24] for i in range(0, len(text), 24)]
+        for chunk in chunks:
+            yield FakeResponse(chunk)
+            time.sleep(self.latency / 2 / len(chunks))
+        self.timings.add(kind, time.perf_counter() - start)
+
+
+class FakeClient:
+    def __init__(self, latency, timings):
+        self.models = FakeModels(latency, timings)
+
+
+def fake_gtts(latency, timings):
+    class FakeGTTS:
+        def __init__(self, text, lang="en", tld="com", timeout=None):
+            self.text = text
+
+        def write_to_fp(self, fp):
+            start = time.perf_counter()
+            time.sleep(latency)
+            fp.write(b"ID3" + self.text.encode()[:64])
+            timings.add("tts", time.perf_counter() - start)
+
+    return FakeGTTS
+
+
+def recording(seconds, seed):
+    """A WAV of speech-like noise between stretches of silence, as a recorder would produce."""
+    rate = 48000
+    rng = np.random.default_rng(seed)
+    voice = rng.normal(0, 0.2, int(rate * seconds)) * np.sin(np.linspace(0, 40 * np.pi, int(rate * seconds))) ** 2
+    silence = np.zeros(rate // 2)
+    buf = io.BytesIO()
+    sf.write(buf, np.concatenate([silence, voice, silence]).astype(np.float32), rate, format="WAV")
+    return buf.getvalue()
+
+
+class Recordings:
+    """st.audio_input stand-in: returns (and stores under its key) whatever the harness set for that key."""
+
+    def __init__(self):
+        self.clips = {}
+
+    def audio_input(self, label, key=None, **_):
+        clip = self.clips.get(key)
+        value = io.BytesIO(clip) if clip is not None else None
+        if key is not None:
+            streamlit.session_state[key] = value
+        return value
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def run_once(args, recordings):
+    timings = Timings()
+    genai.Client = lambda *a, **kw: FakeClient(args.model_latency, timings)
+    import gtts
+    gtts.gTTS = fake_gtts(args.tts_latency, timings)
+    # Imported here, after main() has set the environment its settings are read from.
+    import stress_core
+    streamlit.cache_resource.clear()
+    # A cold speech cache. The app's modules stay loaded between runs, so its directory is
+    # swapped directly.
+    stress_core.TTS_CACHE_DIR = tempfile.mkdtemp(prefix="stress-bench-")
+    recordings.clips = {}
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.run()
+    stages = {}
+    at.text_input[0].input("admin")
+    at.text_input[1].input("Test@123")
+    stages["login"] = timed(button(at, "Sign In").click().run)
+
+    recordings.clips["initial_audio"] = recording(6, 0)
+    stages["intake"] = timed(button(at, "Continue").click().run)
+    if at.session_state.checkin.stage != "followup":
+        sys.exit(f"Intake did not reach the follow-up stage: {[e.value for e in at.error + at.warning]}")
+
+    recordings.clips["fu_audio_0"] = recording(3, 1)
+    recordings.clips["fu_audio_1"] = recording(3, 2)
+    stages["analysis"] = timed(button(at, "Analyze My Stress").click().run)
+    if not at.session_state.checkin.done:
+        sys.exit("Analysis did not finish.")
+    stages["results"] = timed(at.run)
+    stages["rerun"] = statistics.mean(timed(at.run) for _ in range(IDLE_RERUNS))
+    if at.exception:
+        sys.exit(f"The app raised: {at.exception}")
+
+    for kind in ("followups", "tts", "transcription"):
+        stages[kind] = timings.totals.get(kind, 0.0)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model-latency", type=float, default=0.5, help="seconds per fake Gemini call")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="seconds per fake gTTS synthesis")
+    parser.add_argument("--mode", choices=("pipeline", "multimodal"), default="pipeline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["ANALYSIS_MODE"] = args.mode
+    recordings = Recordings()
+    streamlit.audio_input = recordings.audio_input
+
+    runs = [run_once(args, recordings) for _ in range(args.repeat)]
+    medians = {stage: statistics.median(run[stage] for run in runs) for stage in STAGES}
+    settings = {"mode": args.mode, "model_latency": args.model_latency, "tts_latency": args.tts_latency}
+    key = f"{args.mode} model={args.model_latency:g}s tts={args.tts_latency:g}s"
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(key, {}).get("stages", {})
+
+    regressions = []
+    print(f"{'stage':<15}{'median s':>10}{'baseline s':>12}{'change':>9}")
+    for stage in STAGES:
+        line = f"{stage:<15}{medians[stage]:>10.3f}"
+        if stage in baseline:
+            change = medians[stage] / baseline[stage] - 1 if baseline[stage] else 0.0
+            line += f"{baseline[stage]:>12.3f}{change:>+9.0%}"
+            if change > args.tolerance and medians[stage] - baseline[stage] > NOISE_FLOOR_S:
+                regressions.append(stage)
+        print(line)
+
+    if args.save_baseline:
+        baselines[key] = {"settings": settings, "stages": {s: round(v, 4) for s, v in medians.items()}}
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for '{key}' saved to {os.path.relpath(BASELINE_FILE)}.")
+    elif not baseline:
+        print(f"No baseline for '{key}' yet; record one with --save-baseline.")
+    elif regressions:
+        sys.exit(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Time the local lexicon scorer, and analyze_text with and without its deadline.
+
+The local scorer runs offline. The hedged comparison calls the live Gemini API: each sample
+text is analyzed once with no deadline and once with --deadline, and the script reports the
+latency percentiles of both and how often the local estimate had to answer:
+
+    python benchmarks/hedged_analysis.py                           # local scorer only
+    GEMINI_API_KEY=... python benchmarks/hedged_analysis.py --samples 20 --deadline 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stress_core  # noqa: E402
+
+TEXTS = [
+    "I've been so stressed about exams and deadlines that I can't sleep and I feel anxious all the time.",
+    "Work has been fine, honestly I feel pretty relaxed and not stressed at all this week.",
+    "My rent went up, I'm behind on bills and I keep getting headaches. I just feel drained.",
+    "Arguing with my partner a lot lately, and I feel lonely even when we're together.",
+]
+
+
+def percentiles(times):
+    times = sorted(times)
+    return [times[min(len(times) - 1, int(q * len(times)))] for q in (0.5, 0.95)] + [times[-1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=12, help="live analyses per variant")
+    parser.add_argument("--deadline", type=float, default=stress_core.ANALYSIS_DEADLINE_S)
+    args = parser.parse_args()
+
+    scorer = stress_core.LexiconScorer(stress_core.STRESS_LEXICON)
+    runs = 20_000
+    start = time.perf_counter()
+    for i in range(runs):
+        scorer.analyze(TEXTS[i % len(TEXTS)])
+    print(f"local scorer: {(time.perf_counter() - start) / runs * 1e6:.1f} us per text")
+
+    assistant = stress_core.StressAssistant()
+    if not assistant.client:
+        print("Set GEMINI_API_KEY to compare live analyze_text latency with and without the deadline.")
+        return
+
+    print(f"{'variant':<16}{'p50 s':>8}{'p95 s':>8}{'max s':>8}{'local':>8}")
+    for name, deadline in (("no deadline", None), (f"{args.deadline:g} s deadline", args.deadline)):
+        times, local = [], 0
+        for i in range(args.samples):
+            # A distinct text per request, so the response cache does not answer it.
+            text = f"{TEXTS[i % len(TEXTS)]} ({name}, sample {i})"
+            start = time.perf_counter()
+            result = assistant.analyze_text(text, deadline_s=deadline)
+            times.append(time.perf_counter() - start)
+            local += result["source"] == "local"
+        p50, p95, worst = percentiles(times)
+        print(f"{name:<16}{p50:>8.2f}{p95:>8.2f}{worst:>8.2f}{local:>8}")
+
+
+if __name__ == "__main__":
+    main()
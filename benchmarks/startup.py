@@ -0,0 +1,96 @@
+"""Measure stress.py's cold start, and fail when it goes over budget.
+
+Each sample is a fresh interpreter, so nothing is warm: it imports streamlit, then stress,
+then renders the first page (the login screen) with Streamlit's AppTest. Reported (median
+over --samples):
+
+    streamlit_ms   importing streamlit itself, the floor every worker pays
+    import_ms      importing stress.py on top of streamlit
+    import_rss_mb  resident memory added by that import
+    first_run_ms   the first script run (static assets, caches, the login page)
+    rss_mb         resident memory after the first run
+
+The run fails (exit status 1) if import_ms or import_rss_mb is over its budget, or if any of
+stress_core.LAZY_MODULES was imported at startup instead of on first use:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --samples 10 --import-budget-ms 100 --rss-budget-mb 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET_MS = 150
+RSS_BUDGET_MB = 15
+
+# Runs in the fresh interpreter; prints one JSON object.
+SAMPLE = r"""
+import json, logging, sys, time
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * __import__("os").sysconf("SC_PAGE_SIZE") / 2**20
+start = time.perf_counter()
+import streamlit
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+imported_st, base_rss = time.perf_counter(), rss_mb()
+import stress
+imported, import_rss = time.perf_counter(), rss_mb()
+import stress_core  # already loaded by stress
+eager = [m for m in stress_core.LAZY_MODULES if m in sys.modules]
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(stress.__file__, default_timeout=60)
+run_start = time.perf_counter()
+at.run()
+print(json.dumps({
+    "streamlit_ms": (imported_st - start) * 1000,
+    "import_ms": (imported - imported_st) * 1000,
+    "import_rss_mb": import_rss - base_rss,
+    "first_run_ms": (time.perf_counter() - run_start) * 1000,
+    "rss_mb": rss_mb(),
+    "eager": eager,
+}))
+"""
+FIELDS = ("streamlit_ms", "import_ms", "import_rss_mb", "first_run_ms", "rss_mb")
+
+
+def sample():
+    out = subprocess.run([sys.executable, "-c", SAMPLE], cwd=APP_DIR, capture_output=True, text=True,
+                         env={**os.environ, "PYTHONPATH": APP_DIR, "PYTHONDONTWRITEBYTECODE": "1"})
+    if out.returncode:
+        sys.exit(f"Sample failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--rss-budget-mb", type=float, default=RSS_BUDGET_MB)
+    args = parser.parse_args()
+    if not os.path.exists("/proc/self/statm"):
+        sys.exit("Resident memory is read from /proc; run this on Linux.")
+
+    runs = [sample() for _ in range(args.samples)]
+    medians = {field: statistics.median(run[field] for run in runs) for field in FIELDS}
+    for field in FIELDS:
+        print(f"{field:<15}{medians[field]:>10.1f}")
+
+    failures = []
+    if medians["import_ms"] > args.import_budget_ms:
+        failures.append(f"import took {medians['import_ms']:.0f} ms (budget {args.import_budget_ms:g} ms)")
+    if medians["import_rss_mb"] > args.rss_budget_mb:
+        failures.append(f"import added {medians['import_rss_mb']:.1f} MB (budget {args.rss_budget_mb:g} MB)")
+    eager = sorted({m for run in runs for m in run["eager"]})
+    if eager:
+        failures.append(f"imported at startup instead of on first use: {', '.join(eager)}")
+    if failures:
+        sys.exit("Over the startup budget: " + "; ".join(failures))
+    print("Within the startup budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3287 @@
+"""The check-in machinery behind stress.py, loaded once per process.
+
+Scoring, caches, the Gemini assistant and its call gate, speech synthesis, the page assets and
+a session's check-in state live here. Streamlit re-executes stress.py, the UI script, on every
+rerun, so anything costly to define (classes, cached resources, settings, indexes) is kept in
+this module, which is imported once and stays warm.
+"""
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import os
+import io
+import re
+import json
+import queue
+import base64
+import bisect
+import hashlib
+import importlib
+import itertools
+import operator
+import concurrent.futures
+import contextlib
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+
+# ---------------------- LAZY IMPORTS ----------------------
+class LazyModule:
+    """A module imported on first attribute access and held from then on.
+
+    Keeps heavy dependencies out of process startup: each is imported once, by the first code
+    path that needs it, and a worker that never synthesizes speech never loads gTTS.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+np = LazyModule("numpy")
+sf = LazyModule("soundfile")
+httpx = LazyModule("httpx")
+genai = LazyModule("google.genai")
+genai_types = LazyModule("google.genai.types")
+genai_errors = LazyModule("google.genai.errors")
+gtts = LazyModule("gtts")
+PIL_Image = LazyModule("PIL.Image")
+# Never imported at startup; benchmarks/startup.py checks they stay out of it.
+LAZY_MODULES = ("numpy", "soundfile", "httpx", "google.genai", "gtts", "PIL")
+
+# ---------------------- CSS ----------------------
+APP_CSS = """
+<style>
+    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
+
+    :root {
+        --grad-primary: linear-gradient(135deg, #4f46e5 0%, #7c3aed 50%, #db2777 100%);
+        --grad-accent:  linear-gradient(135deg, #6366f1 0%, #8b5cf6 100%);
+        --grad-surface: linear-gradient(135deg, #ffffff 0%, #f4f5ff 100%);
+        --grad-success: linear-gradient(135deg, #059669 0%, #10b981 100%);
+        --grad-danger:  linear-gradient(135deg, #e11d48 0%, #fb7185 100%);
+        --grad-neutral: linear-gradient(135deg, #475569 0%, #64748b 100%);
+        --ink:        #1e293b;
+        --ink-soft:   #64748b;
+        --line:       rgba(99, 102, 241, 0.14);
+        --shadow:     0 10px 30px rgba(30, 41, 59, 0.08);
+        --shadow-lg:  0 18px 45px rgba(79, 70, 229, 0.18);
+    }
+
+    html, body, [class*="css"], .stMarkdown, .stApp {
+        font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+    }
+
+    /* App backdrop */
+    .stApp {
+        background:
+            radial-gradient(1200px 600px at 12% -10%, rgba(124, 58, 237, 0.10), transparent 60%),
+            radial-gradient(1000px 500px at 100% 0%, rgba(219, 39, 119, 0.08), transparent 55%),
+            linear-gradient(180deg, #f7f8ff 0%, #eef1fb 100%);
+        background-attachment: fixed;
+    }
+
+    /* Headings */
+    .main-header {
+        font-size: 2.85rem;
+        font-weight: 800;
+        text-align: center;
+        letter-spacing: -0.03em;
+        margin: 0.5rem 0 0.25rem 0;
+        background: var(--grad-primary);
+        -webkit-background-clip: text;
+        background-clip: text;
+        -webkit-text-fill-color: transparent;
+    }
+    .subtitle {
+        font-size: 1.05rem;
+        color: var(--ink-soft);
+        text-align: center;
+        margin-bottom: 2.5rem;
+        font-weight: 500;
+    }
+
+    /* Section title accent */
+    .section-title {
+        font-size: 1.35rem;
+        font-weight: 700;
+        color: var(--ink);
+        letter-spacing: -0.01em;
+        margin: 1.2rem 0 0.25rem 0;
+        display: flex;
+        align-items: center;
+        gap: 0.6rem;
+    }
+    .section-title::before {
+        content: "";
+        width: 6px;
+        height: 1.35rem;
+        border-radius: 6px;
+        background: var(--grad-accent);
+    }
+
+    /* Generic card surfaces */
+    .info-box, .result-box, .feedback-box,
+    .sentiment-positive, .sentiment-negative, .sentiment-neutral,
+    .session-complete {
+        border-radius: 18px;
+        margin: 1.1rem 0;
+        box-shadow: var(--shadow);
+    }
+
+    .info-box {
+        background: var(--grad-surface);
+        border: 1px solid var(--line);
+        border-left: 5px solid #6366f1;
+        padding: 1.5rem 1.75rem;
+        color: var(--ink);
+    }
+    .info-box h3 { color: #4338ca; font-weight: 700; margin: 0 0 0.6rem 0; }
+
+    .result-box {
+        background: var(--grad-accent);
+        padding: 1.75rem 1.9rem;
+        color: #ffffff;
+        box-shadow: var(--shadow-lg);
+    }
+    .result-box h3 { color: #ffffff; font-weight: 700; margin: 0 0 0.6rem 0; }
+
+    .feedback-box {
+        background: var(--grad-surface);
+        border: 1px solid var(--line);
+        padding: 1.6rem 1.75rem;
+        text-align: center;
+        color: var(--ink);
+    }
+    .feedback-box h3 { color: #4338ca; font-weight: 700; margin: 0 0 0.5rem 0; }
+
+    .session-complete {
+        background: var(--grad-success);
+        padding: 2rem;
+        text-align: center;
+        color: #ffffff;
+        box-shadow: 0 18px 45px rgba(5, 150, 105, 0.28);
+    }
+    .session-complete h2 { margin: 0 0 0.4rem 0; font-weight: 800; }
+
+    /* Stress meter */
+    .stress-score-num {
+        font-size: 2.8rem;
+        font-weight: 800;
+        color: var(--ink);
+        line-height: 1;
+    }
+    .band-badge {
+        display: inline-block;
+        padding: 0.3rem 1.1rem;
+        border-radius: 999px;
+        font-weight: 700;
+        font-size: 0.85rem;
+        letter-spacing: 0.06em;
+        color: #ffffff;
+    }
+    .meter-track {
+        position: relative;
+        height: 16px;
+        border-radius: 999px;
+        margin: 1rem 0 0.4rem 0;
+        background: linear-gradient(90deg, #10b981 0%, #f59e0b 55%, #ef4444 100%);
+        box-shadow: inset 0 1px 3px rgba(0,0,0,0.15);
+    }
+    .meter-marker {
+        position: absolute;
+        top: 50%;
+        width: 22px;
+        height: 22px;
+        border-radius: 50%;
+        background: #ffffff;
+        border: 4px solid #1e293b;
+        transform: translate(-50%, -50%);
+        box-shadow: 0 3px 8px rgba(0,0,0,0.25);
+    }
+    .meter-scale {
+        display: flex;
+        justify-content: space-between;
+        font-size: 0.72rem;
+        color: var(--ink-soft);
+        font-weight: 600;
+    }
+
+    /* Fact / factor items */
+    .fact-item {
+        background: var(--grad-surface);
+        border: 1px solid var(--line);
+        border-left: 4px solid #8b5cf6;
+        border-radius: 12px;
+        padding: 0.9rem 1.1rem;
+        margin: 0.6rem 0;
+        color: var(--ink);
+        line-height: 1.55;
+    }
+    .fact-item strong { color: #4338ca; }
+
+    /* Disclaimer */
+    .disclaimer {
+        font-size: 0.85rem;
+        color: var(--ink-soft);
+        background: rgba(99, 102, 241, 0.06);
+        border: 1px solid var(--line);
+        border-radius: 12px;
+        padding: 0.9rem 1.1rem;
+        margin: 1.2rem 0;
+        line-height: 1.55;
+    }
+
+    /* Buttons */
+    .stButton > button {
+        background: var(--grad-accent);
+        color: #ffffff;
+        border: none;
+        border-radius: 12px;
+        padding: 0.6rem 2rem;
+        font-weight: 600;
+        letter-spacing: 0.01em;
+        box-shadow: 0 8px 20px rgba(99, 102, 241, 0.28);
+        transition: transform 0.18s ease, box-shadow 0.18s ease, filter 0.18s ease;
+    }
+    .stButton > button:hover {
+        transform: translateY(-2px);
+        box-shadow: 0 12px 26px rgba(99, 102, 241, 0.38);
+        filter: brightness(1.05);
+    }
+    .stButton > button:active { transform: translateY(0); }
+
+    /* Link button (feedback) */
+    .link-btn {
+        background: var(--grad-primary);
+        color: #ffffff !important;
+        padding: 0.75rem 2.2rem;
+        text-decoration: none;
+        border-radius: 12px;
+        font-weight: 600;
+        font-size: 1rem;
+        display: inline-block;
+        box-shadow: 0 10px 24px rgba(124, 58, 237, 0.32);
+        transition: transform 0.18s ease, box-shadow 0.18s ease;
+    }
+    .link-btn:hover {
+        transform: translateY(-2px);
+        box-shadow: 0 14px 30px rgba(124, 58, 237, 0.42);
+    }
+
+    /* Inputs */
+    .stTextInput > div > div > input, .stTextArea textarea {
+        border-radius: 12px;
+        border: 1px solid var(--line);
+    }
+    .stTextInput > div > div > input:focus, .stTextArea textarea:focus {
+        border-color: #6366f1;
+        box-shadow: 0 0 0 3px rgba(99, 102, 241, 0.15);
+    }
+
+    /* Tabs */
+    .stTabs [data-baseweb="tab-list"] {
+        gap: 0.5rem;
+        border-bottom: 1px solid var(--line);
+    }
+    .stTabs [data-baseweb="tab"] {
+        font-weight: 600;
+        color: var(--ink-soft);
+        border-radius: 10px 10px 0 0;
+        padding: 0.5rem 1.1rem;
+    }
+    .stTabs [aria-selected="true"] {
+        color: #4338ca;
+        background: rgba(99, 102, 241, 0.08);
+    }
+
+    /* Sidebar */
+    section[data-testid="stSidebar"] {
+        background: linear-gradient(180deg, #ffffff 0%, #f3f4ff 100%);
+        border-right: 1px solid var(--line);
+    }
+
+    /* Brand logo */
+    .brand-logo {
+        display: flex;
+        justify-content: center;
+        margin: 0.5rem 0 0.25rem 0;
+    }
+    .brand-logo svg, .brand-logo img {
+        filter: drop-shadow(0 12px 24px rgba(79, 70, 229, 0.30));
+    }
+    .brand-logo img {
+        height: 92px;
+        width: auto;
+        object-fit: contain;
+    }
+</style>
+"""
+
+# ---------------------- BRAND LOGO ----------------------
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGO_FILE = os.path.join(APP_DIR, "NCAI Logo icon-05.png")
+# The logo is shown 92px tall; keep 2x that for high-DPI screens.
+LOGO_HEIGHT_PX = 184
+# Served by Streamlit at app/static/ when server.enableStaticServing is on (.streamlit/config.toml).
+STATIC_DIR = os.path.join(APP_DIR, "static")
+
+# Gradient SVG fallback, used only if the logo image cannot be found.
+LOGO_SVG = """
+<div class="brand-logo">
+<svg width="76" height="76" viewBox="0 0 84 84" fill="none" xmlns="http://www.w3.org/2000/svg">
+  <defs>
+    <linearGradient id="brandGrad" x1="0" y1="0" x2="84" y2="84" gradientUnits="userSpaceOnUse">
+      <stop stop-color="#4f46e5"/>
+      <stop offset="0.5" stop-color="#7c3aed"/>
+      <stop offset="1" stop-color="#db2777"/>
+    </linearGradient>
+  </defs>
+  <rect x="2" y="2" width="80" height="80" rx="22" fill="url(#brandGrad)"/>
+  <circle cx="42" cy="42" r="23" stroke="#ffffff" stroke-opacity="0.28" stroke-width="2.5"/>
+  <path d="M20 49 Q31 35 42 49 T64 49" stroke="#ffffff" stroke-width="3.2"
+        stroke-linecap="round" fill="none" opacity="0.95"/>
+  <path d="M20 38 Q31 24 42 38 T64 38" stroke="#ffffff" stroke-width="3.2"
+        stroke-linecap="round" fill="none" opacity="0.6"/>
+</svg>
+</div>
+"""
+
+
+# ---------------------- CONSTANTS ----------------------
+FEEDBACK_FORM_URL = "https://docs.google.com/forms/d/your-form-id-here/viewform?usp=sharing"
+
+# Gemini LLM configuration. Prefer Streamlit Secrets / env var so the key stays out of git;
+# the hardcoded value below is only a last-resort fallback for quick local runs.
+GEMINI_API_KEY = "YOUR_GEMINI_API_KEY"
+GEMINI_TEXT_MODEL = "gemini-2.5-flash"
+
+
+def get_api_key():
+    """Resolve the Gemini API key: Streamlit secret first, then env var, then hardcoded fallback."""
+    try:
+        secret = st.secrets.get("GEMINI_API_KEY")
+        if secret:
+            return str(secret).strip()
+    except Exception:
+        pass  # No secrets file configured; fall through to env var / hardcoded value.
+    return os.environ.get("GEMINI_API_KEY", "").strip() or GEMINI_API_KEY
+
+# ---------------------- STATIC HTML FRAGMENTS ----------------------
+DISCLAIMER_HTML = """
+<div class="disclaimer">
+This check-in is a self-reflection tool, not a medical assessment or diagnosis. If your stress feels
+unmanageable, or if you ever have thoughts of harming yourself, please contact a qualified professional
+or your local emergency or crisis line right away.
+</div>
+"""
+
+SESSION_COMPLETE_HTML = """
+<div class="session-complete">
+<h2>Check-In Complete</h2>
+<p>You took a positive step today by pausing to check in with yourself.</p>
+</div>
+"""
+
+FEEDBACK_HTML = """
+<div class="feedback-box">
+    <h3>Help Us Support You Better</h3>
+    <p style="font-size:1.05rem; margin:0.5rem 0;">
+        Your anonymous feedback helps improve this assistant for everyone.
+    </p>
+    <p style="font-size:0.95rem; color:#64748b;">It takes less than a minute.</p>
+</div>
+"""
+
+FEEDBACK_LINK_HTML = f"""
+<div style="text-align:center; margin: 0.5rem 0 1.5rem 0;">
+    <a href="{FEEDBACK_FORM_URL}" target="_blank" class="link-btn">Share Your Feedback</a>
+</div>
+"""
+
+
+# ---------------------- STATIC ASSET BUNDLE ----------------------
+@dataclass(frozen=True)
+class StaticAssets:
+    """Immutable, precomputed page assets shared by every session and rerun."""
+    version: str  # content hash of everything below; changes whenever an asset changes
+    css: str
+    logo_html: str
+    results_footer_html: str  # disclaimer, session complete and feedback, in one element
+    feedback_link_html: str
+
+
+def _minify(markup):
+    """Strip CSS comments and collapse whitespace so less markup goes over the websocket."""
+    markup = re.sub(r"/\*.*?\*/", "", markup, flags=re.S)
+    return re.sub(r"\s+", " ", markup).strip()
+
+
+def _minify_css(css):
+    """Minify a <style> block, also dropping the spaces around CSS punctuation."""
+    return re.sub(r"\s*([{};,>])\s*", r"\1", _minify(css))
+
+
+def _optimized_logo():
+    """Return the logo resized for display and palette-quantized as PNG bytes, or None if missing.
+
+    The result is kept on disk, keyed by the source image, so only the first process on a
+    machine pays for decoding and resizing it (and for importing Pillow).
+    """
+    try:
+        with open(LOGO_FILE, "rb") as f:
+            source = f.read()
+    except OSError:
+        return None
+    key = hashlib.sha256(source + str(LOGO_HEIGHT_PX).encode()).hexdigest()[:16]
+    path = os.path.join(tempfile.gettempdir(), f"stress-app-logo.{key}.png")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+    try:
+        with PIL_Image.open(io.BytesIO(source)) as im:
+            im = im.convert("RGBA")
+            im.thumbnail((im.width, LOGO_HEIGHT_PX), PIL_Image.LANCZOS)
+            im = im.quantize(256, method=PIL_Image.Quantize.FASTOCTREE)
+            buf = io.BytesIO()
+            im.save(buf, "PNG", optimize=True)
+    except Exception:
+        return None
+    png = buf.getvalue()
+    try:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # Unwritable temp dir: the next process just resizes it again.
+    return png
+
+
+def _logo_src(png):
+    """Serve the logo as a content-hashed static file when possible, else inline it as a data URI.
+
+    The file is named after the PNG bytes alone, so CSS or HTML edits don't mint a new one;
+    writing a new one removes the logos left behind by earlier versions.
+    """
+    name = f"logo.{hashlib.sha256(png).hexdigest()[:12]}.png"
+    try:
+        if st.get_option("server.enableStaticServing"):
+            path = os.path.join(STATIC_DIR, name)
+            if not os.path.exists(path):
+                os.makedirs(STATIC_DIR, exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(png)
+                os.replace(tmp, path)
+                for stale in os.listdir(STATIC_DIR):
+                    if stale != name and re.fullmatch(r"logo\.[0-9a-f]{12}\.png", stale):
+                        try:
+                            os.remove(os.path.join(STATIC_DIR, stale))
+                        except OSError:
+                            pass  # Already removed by another process.
+            return f"app/static/{name}"
+    except Exception:
+        pass  # Read-only checkout or static serving unavailable; inline the (small) image instead.
+    return "data:image/png;base64," + base64.b64encode(png).decode()
+
+
+@st.cache_resource
+def static_assets():
+    """Build the static asset bundle once per process: minified CSS, optimized logo, fixed HTML."""
+    png = _optimized_logo()
+    fragments = {
+        "css": _minify_css(APP_CSS),
+        "results_footer_html": _minify(DISCLAIMER_HTML + SESSION_COMPLETE_HTML + FEEDBACK_HTML),
+        "feedback_link_html": _minify(FEEDBACK_LINK_HTML),
+    }
+    h = hashlib.sha256(png or LOGO_SVG.encode())
+    for value in fragments.values():
+        h.update(value.encode())
+    version = h.hexdigest()[:12]
+
+    if png:
+        logo_html = (f'<div class="brand-logo"><img src="{_logo_src(png)}" '
+                     f'alt="NCAI logo"/></div>')
+    else:
+        logo_html = _minify(LOGO_SVG)
+    return StaticAssets(version=version, logo_html=logo_html, **fragments)
+
+
+def get_setting(name, default=None):
+    """Resolve an app setting: Streamlit secret first, then env var, then the given default."""
+    try:
+        value = st.secrets.get(name)
+        if value is not None:
+            return value
+    except Exception:
+        pass  # No secrets file configured; fall through to env var / default.
+    return os.environ.get(name, default)
+
+
+def get_flag(name, default=False):
+    """Resolve an on/off setting ("1", "true", "yes" and "on" count as on)."""
+    value = get_setting(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+VALID_USERS = {"admin", "trial1", "trial2"}
+VALID_PASSWORD = "Test@123"
+
+BAND_COLORS = {"LOW": "#10b981", "MODERATE": "#f59e0b", "HIGH": "#f97316", "SEVERE": "#ef4444"}
+BAND_SUMMARY = {
+    "LOW": "Your stress appears well managed right now. Keep doing what is working for you.",
+    "MODERATE": "You are carrying a noticeable but manageable amount of stress today.",
+    "HIGH": "Your stress level is elevated. It is worth taking some deliberate steps to ease it today.",
+    "SEVERE": "Your stress level is very high. Please be gentle with yourself, and consider reaching out to someone you trust or a professional.",
+}
+# Guidance shown straight away for a questionnaire check-in (the assistant may tailor it afterwards).
+BAND_GUIDANCE = {
+    "LOW": "Keep protecting the habits that are working, like sleep and regular movement. "
+           "A short walk or a few slow breaths today helps keep it that way.",
+    "MODERATE": "Pick one thing on your mind and take the smallest next step on it today. "
+                "Then give yourself a 10-minute break away from screens.",
+    "HIGH": "Take five slow breaths with longer out-breaths, then step outside or move for 10 minutes. "
+            "Let one non-essential task wait until tomorrow.",
+    "SEVERE": "Pause for a few slow breaths and reach out to someone you trust today. "
+              "If this feels overwhelming, a doctor or counsellor can help you carry it.",
+}
+CONTROL_OPTIONS = ["Never", "Almost never", "Sometimes", "Fairly often", "Very often"]
+SYMPTOM_OPTIONS = ["Headache", "Muscle tension", "Fatigue", "Racing heart", "Trouble sleeping", "Appetite changes", "None"]
+STRESSOR_OPTIONS = ["Work or study", "Relationships", "Finances", "Health", "Family",
+                    "Uncertainty about the future", "Other", "Prefer not to say"]
+
+
+# ---------------------- STRESS SCORING (deterministic, evidence-informed) ----------------------
+BANDS = ("LOW", "MODERATE", "HIGH", "SEVERE")
+ENERGY_LEVELS = ("Low", "Moderate", "High")
+ENERGY_POINTS = {"Low": 10, "Moderate": 5, "High": 0}
+# Option lists of the categorical intake fields; integer codes in batch input index into these.
+FIELD_OPTIONS = {"control": CONTROL_OPTIONS, "energy": ENERGY_LEVELS, "stressor": STRESSOR_OPTIONS}
+
+
+@dataclass(frozen=True)
+class Rule:
+    """A declarative intake rule: when `field <op> value` holds, it contributes a factor or a fact.
+
+    Ops: "<", "<=", ">=", ">" on numbers; "in" / "not in" on a categorical field; "any" when a
+    list field (symptoms) contains any of `value`; "always" (no field) for unconditional rules.
+    A factor's `text` is its detail line and may use {placeholders} from _RuleContext, and its
+    `label` its title. A fact's `label` is a short name, by which STRESS_LEXICON refers to it.
+    """
+    kind: str  # "factor" or "fact"
+    field: str
+    op: str
+    value: object
+    text: str
+    label: str = ""
+
+
+# The single source of truth for factors and facts. Factors keep this order in the results,
+# and facts are shown in this order, capped at MAX_FACTS.
+STRESS_RULES = (
+    Rule("factor", "stress_now", ">=", 7, "You rated your current stress at {stress_now}/10.",
+         "High self-reported stress"),
+    Rule("factor", "sleep_hours", "<", 7, "{sleep_hours:g} hours last night is below the recommended 7-9.",
+         "Short sleep"),
+    Rule("factor", "control", "in", {"Fairly often", "Very often"},
+         "You often felt unable to control important things this past week.", "Low sense of control"),
+    Rule("factor", "energy", "in", {"Low"}, "Low energy can both result from and intensify stress.", "Low energy"),
+    Rule("factor", "symptoms", "any", set(SYMPTOM_OPTIONS) - {"None"}, "You reported: {symptom_list}.",
+         "Physical signs of stress"),
+    Rule("factor", "exercise_days", "<=", 1, "Movement is one of the most effective natural stress regulators.",
+         "Little physical activity"),
+    Rule("factor", "stressor", "not in", {"Prefer not to say"},
+         "You identified {stressor_lower} as your main source of stress.", "Primary stressor"),
+
+    Rule("fact", "sleep_hours", "<", 7,
+         "Adults generally need 7-9 hours of sleep. Even one short night raises cortisol "
+         "and makes stress noticeably harder to regulate the next day.", "sleep"),
+    Rule("fact", "exercise_days", "<=", 2,
+         "A single 20-30 minute walk can measurably lower stress hormones and lift mood "
+         "through the release of endorphins.", "exercise"),
+    Rule("fact", "symptoms", "any", {"Racing heart"},
+         "A racing heart under stress is driven by adrenaline. Breathing out for longer "
+         "than you breathe in (try 4 seconds in, 6 out) helps switch on the body's calming response.", "adrenaline"),
+    Rule("fact", "symptoms", "any", {"Muscle tension", "Headache"},
+         "Stress often shows up physically as muscle tension or headaches before we "
+         "consciously notice we are stressed.", "tension"),
+    Rule("fact", "control", "in", {"Fairly often", "Very often"},
+         "A feeling of losing control is one of the strongest drivers of stress. Choosing "
+         "one small, doable action restores a real sense of agency.", "control"),
+    Rule("fact", "stressor", "in", {"Work or study", "Finances"},
+         "Ongoing pressure from work or money is among the most common chronic stressors. "
+         "Short, regular breaks every 60-90 minutes reduce how much it builds up.", "chronic"),
+    # Always close with a grounding, normalizing fact.
+    Rule("fact", None, "always", None,
+         "Stress itself is a normal, adaptive response. The goal is not to remove it, but to "
+         "keep it from staying switched on for too long.", "normal"),
+)
+MAX_FACTS = 4
+NUMERIC_MEMO_ENTRIES = 1024  # per numeric field, in RuleIndex.mask
+
+_NUMERIC_OPS = {"<": operator.lt, "<=": operator.le, ">=": operator.ge, ">": operator.gt}
+
+
+class RuleIndex:
+    """A rule table compiled into per-field lookups that yield a bitmask of matching rules.
+
+    Bit i of a mask means rules[i] applies. Numeric fields are bisected against their sorted
+    thresholds, categorical fields and list members are dictionary lookups, so evaluating an
+    intake costs one lookup per field however many rules there are. mask_batch() does the
+    same for whole NumPy columns.
+    """
+
+    def __init__(self, rules):
+        texts = [r.text for r in rules if r.kind == "fact"]
+        if len(set(texts)) != len(texts):
+            raise ValueError("Fact rules must have distinct texts.")
+        self.rules = rules
+        self.factor_bits = [i for i, r in enumerate(rules) if r.kind == "factor"]
+        self.fact_bits = [i for i, r in enumerate(rules) if r.kind == "fact"]
+        self.factor_labels = tuple(rules[i].label for i in self.factor_bits)
+        self.always = 0
+        self._factor_cache = {}  # mask of factor bits -> ((label, template, needs formatting), ...)
+        self._fact_cache = {}    # mask of fact bits -> [text, ...]
+        self._factor_mask = sum(1 << bit for bit in self.factor_bits)
+        self._fact_mask = sum(1 << bit for bit in self.fact_bits)
+        self.numeric = {}      # field -> (sorted thresholds, mask per region; see _region)
+        self.categorical = {}  # field -> ({value: mask}, mask for any other value)
+        self.members = {}      # field -> {list member: mask}
+        self._numeric_seen = {}  # field -> {value: mask}, memoised region lookups
+
+        by_field = {}
+        for bit, rule in enumerate(rules):
+            if rule.op == "always":
+                self.always |= 1 << bit
+            else:
+                by_field.setdefault(rule.field, []).append((bit, rule))
+
+        for field, field_rules in by_field.items():
+            ops = {rule.op for _, rule in field_rules}
+            if ops <= set(_NUMERIC_OPS):
+                thresholds = sorted({rule.value for _, rule in field_rules})
+                # Regions alternate: below t0, at t0, between t0 and t1, at t1, ..., above t_last.
+                points = [thresholds[0] - 1]
+                for lo, hi in zip(thresholds, thresholds[1:] + [thresholds[-1] + 2]):
+                    points += [lo, (lo + hi) / 2]
+                self._numeric_seen[field] = {}
+                self.numeric[field] = (thresholds, [
+                    self._mask_for(field_rules, lambda rule, p=p: _NUMERIC_OPS[rule.op](p, rule.value))
+                    for p in points
+                ])
+            elif ops <= {"in", "not in"}:
+                values = set(FIELD_OPTIONS.get(field, ())).union(*(rule.value for _, rule in field_rules))
+                lookup = {
+                    v: self._mask_for(field_rules, lambda rule, v=v: (v in rule.value) == (rule.op == "in"))
+                    for v in values
+                }
+                self.categorical[field] = (lookup, self._mask_for(field_rules, lambda rule: rule.op == "not in"))
+            elif ops == {"any"}:
+                members = {}
+                for bit, rule in field_rules:
+                    for member in rule.value:
+                        members[member] = members.get(member, 0) | 1 << bit
+                self.members[field] = members
+            else:
+                raise ValueError(f"Rules on {field!r} mix incompatible ops: {sorted(ops)}")
+
+    @staticmethod
+    def _mask_for(field_rules, holds):
+        return sum(1 << bit for bit, rule in field_rules if holds(rule))
+
+    @staticmethod
+    def _region(thresholds, value):
+        i = bisect.bisect_left(thresholds, value)
+        return 2 * i + (i < len(thresholds) and thresholds[i] == value)
+
+    def mask(self, intake):
+        """Bitmask of the rules this intake satisfies."""
+        mask = self.always
+        for field, (thresholds, masks) in self.numeric.items():
+            # The form only offers a handful of values per field, so regions are memoised.
+            seen = self._numeric_seen[field]
+            value = intake[field]
+            region_mask = seen.get(value)
+            if region_mask is None:
+                region_mask = masks[self._region(thresholds, value)]
+                if len(seen) < NUMERIC_MEMO_ENTRIES:
+                    seen[value] = region_mask
+            mask |= region_mask
+        for field, (lookup, other) in self.categorical.items():
+            mask |= lookup.get(intake[field], other)
+        for field, members in self.members.items():
+            for member in intake[field]:
+                mask |= members.get(member, 0)
+        return mask
+
+    def factors(self, intake, mask=None):
+        """(label, detail) pairs for the factor rules this intake satisfies, in table order."""
+        mask = (self.mask(intake) if mask is None else mask) & self._factor_mask
+        matched = self._factor_cache.get(mask)
+        if matched is None:
+            matched = self._factor_cache[mask] = tuple(
+                (self.rules[bit].label, self.rules[bit].text, "{" in self.rules[bit].text)
+                for bit in self.factor_bits if mask >> bit & 1
+            )
+        context = _RuleContext(intake)
+        return [(label, text.format_map(context) if templated else text) for label, text, templated in matched]
+
+    def facts(self, intake, mask=None):
+        """Texts of the fact rules this intake satisfies, in table order (not capped)."""
+        mask = (self.mask(intake) if mask is None else mask) & self._fact_mask
+        matched = self._fact_cache.get(mask)
+        if matched is None:
+            matched = self._fact_cache[mask] = [self.rules[bit].text for bit in self.fact_bits if mask >> bit & 1]
+        return list(matched)
+
+    def mask_batch(self, columns):
+        """Rule bitmasks for columnar intakes (see compute_stress_index_batch for the input forms)."""
+        n = len(columns["stress_now"])
+        masks = np.full(n, self.always, dtype=np.int64)
+        for field, (thresholds, region_masks) in self.numeric.items():
+            values = np.asarray(columns[field], dtype=np.float64)
+            i = np.searchsorted(thresholds, values, side="left")
+            exact = np.asarray(thresholds + [np.nan])[i] == values
+            masks |= np.asarray(region_masks, dtype=np.int64)[2 * i + exact]
+        for field, (lookup, other) in self.categorical.items():
+            options = FIELD_OPTIONS.get(field, ())
+            codes = _category_codes(columns[field], options, default=len(options))
+            codes = np.where((codes >= 0) & (codes < len(options)), codes, len(options))
+            table = np.asarray([lookup.get(v, other) for v in options] + [other], dtype=np.int64)
+            masks |= table[codes]
+        for field, members in self.members.items():
+            # Every combination of SYMPTOM_OPTIONS bits maps straight onto a rule mask.
+            member_masks = [members.get(name, 0) for name in SYMPTOM_OPTIONS]
+            table = np.zeros(1 << len(SYMPTOM_OPTIONS), dtype=np.int64)
+            for combo in range(table.size):
+                for b, m in enumerate(member_masks):
+                    if combo >> b & 1:
+                        table[combo] |= m
+            masks |= table[_symptom_column(columns[field])]
+        return masks
+
+    @staticmethod
+    def pack(masks, bits):
+        """Repack the given rule bits of each mask into consecutive bits 0, 1, 2, ..."""
+        packed = masks & 0
+        for i, bit in enumerate(bits):
+            packed |= (masks >> bit & 1) << i
+        return packed
+
+
+class _RuleContext(dict):
+    """Values available to factor detail templates: the intake fields plus a few derived ones."""
+
+    def __missing__(self, key):
+        if key == "symptom_list":
+            return ", ".join(s.lower() for s in self["symptoms"] if s != "None")
+        if key == "stressor_lower":
+            return self["stressor"].lower()
+        raise KeyError(key)
+
+
+RULE_INDEX = RuleIndex(STRESS_RULES)
+# Factor bits reported by compute_stress_index_batch, in the order compute_stress_index lists them.
+FACTOR_LABELS = RULE_INDEX.factor_labels
+# Fact bits reported by compute_stress_index_batch, in the order select_stress_facts lists them.
+FACT_TEXTS = tuple(STRESS_RULES[i].text for i in RULE_INDEX.fact_bits)
+
+
+def compute_stress_index(intake):
+    """Turn the intake answers into a 0-100 stress index, a band, and the factors driving it."""
+    score = 0.0
+
+    # Current self-reported stress carries the most weight (up to 40 pts).
+    score += intake["stress_now"] / 10 * 40
+
+    # Sleep debt below the recommended 7 hours (up to 15 pts).
+    if intake["sleep_hours"] < 7:
+        score += (7 - intake["sleep_hours"]) / 7 * 15
+
+    # Perceived loss of control — a core driver of chronic stress (up to 20 pts).
+    control_level = CONTROL_OPTIONS.index(intake["control"])  # 0..4
+    score += control_level / 4 * 20
+
+    # Energy (up to 10 pts).
+    score += ENERGY_POINTS.get(intake["energy"], 5)
+
+    # Physical symptoms (up to 10 pts).
+    symptoms = [s for s in intake["symptoms"] if s != "None"]
+    score += min(len(symptoms), 4) / 4 * 10
+
+    # Physical inactivity (up to 5 pts).
+    score += (7 - intake["exercise_days"]) / 7 * 5
+
+    # The factors behind the score (and the primary stressor, for context) come from STRESS_RULES.
+    factors = RULE_INDEX.factors(intake)
+
+    score = int(max(0, min(100, round(score))))
+    if score <= 25:
+        band = "LOW"
+    elif score <= 50:
+        band = "MODERATE"
+    elif score <= 75:
+        band = "HIGH"
+    else:
+        band = "SEVERE"
+    return score, band, factors
+
+
+def symptom_mask(symptoms):
+    """Encode a list of SYMPTOM_OPTIONS names as an integer bitmask (bit i = SYMPTOM_OPTIONS[i])."""
+    return sum(1 << SYMPTOM_OPTIONS.index(s) for s in set(symptoms))
+
+
+def _category_codes(values, options, default=None):
+    """Map a column of option names (or integer codes) onto integer codes into `options`.
+
+    Names not in `options` get `default`, or raise ValueError when no default is given.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iu":
+        return values.astype(np.int64)
+    unknown = -1 - len(options) if default is None else default
+    lookup = {name: i for i, name in enumerate(options)}
+    codes = np.fromiter(map(lookup.get, values, itertools.repeat(unknown)), dtype=np.int64, count=len(values))
+    if default is None and (codes == unknown).any():
+        bad = next(v for v in values if v not in lookup)
+        raise ValueError(f"{bad!r} is not one of {list(options)}")
+    return codes
+
+
+def _symptom_masks(symptoms):
+    """Turn a column of symptom-name lists into symptom_mask() values without a per-row Python loop."""
+    lengths = np.fromiter(map(len, symptoms), dtype=np.int64, count=len(symptoms))
+    codes = _category_codes(list(itertools.chain.from_iterable(symptoms)), SYMPTOM_OPTIONS)
+    masks = np.zeros(len(symptoms), dtype=np.int64)
+    np.bitwise_or.at(masks, np.repeat(np.arange(len(symptoms)), lengths), np.left_shift(1, codes))
+    return masks
+
+
+def _symptom_column(symptoms):
+    """A symptoms column as symptom_mask() integers, whichever form it came in."""
+    if isinstance(symptoms, np.ndarray) and symptoms.dtype.kind in "iu":
+        return symptoms.astype(np.int64)
+    return _symptom_masks(symptoms)
+
+
+def compute_stress_index_batch(intakes):
+    """Score many intakes at once with NumPy; the batch twin of compute_stress_index.
+
+    `intakes` is columnar: a dict of equal-length arrays/lists, or a NumPy structured array,
+    with the same fields as a single intake. `control`, `energy` and `stressor` may be option
+    names or integer codes into CONTROL_OPTIONS / ENERGY_LEVELS / STRESSOR_OPTIONS;
+    `symptoms` may be a list of name lists or an integer column of symptom_mask() values
+    (the only form a structured array can hold).
+
+    Returns a dict of arrays: `score` (int), `band` (str), `factors`, a bitmask where bit i
+    set means FACTOR_LABELS[i] applies, and `facts`, a bitmask over FACT_TEXTS (uncapped;
+    select_stress_facts shows the first MAX_FACTS). Everything matches the scalar functions.
+    """
+    stress_now = np.asarray(intakes["stress_now"], dtype=np.float64)
+    sleep = np.asarray(intakes["sleep_hours"], dtype=np.float64)
+    exercise = np.asarray(intakes["exercise_days"], dtype=np.float64)
+    control = _category_codes(intakes["control"], CONTROL_OPTIONS)
+    energy = _category_codes(intakes["energy"], ENERGY_LEVELS, default=len(ENERGY_LEVELS))
+    symptoms = _symptom_column(intakes["symptoms"])
+    none_bit = SYMPTOM_OPTIONS.index("None")
+    n_symptoms = sum((symptoms >> i) & 1 for i in range(len(SYMPTOM_OPTIONS)) if i != none_bit)
+
+    # Same terms, in the same order, as compute_stress_index so the float sums match bit for bit.
+    score = np.zeros(stress_now.shape)
+    score += stress_now / 10 * 40
+    score += np.where(sleep < 7, (7 - sleep) / 7 * 15, 0.0)
+    score += control / 4 * 20
+    score += np.asarray([ENERGY_POINTS[e] for e in ENERGY_LEVELS] + [5], dtype=np.float64)[energy]
+    score += np.minimum(n_symptoms, 4) / 4 * 10
+    score += (7 - exercise) / 7 * 5
+    score = np.clip(np.round(score), 0, 100).astype(np.int64)
+
+    columns = {name: intakes[name] for name in ("stress_now", "sleep_hours", "exercise_days",
+                                                "control", "energy", "stressor")}
+    columns["symptoms"] = symptoms
+    masks = RULE_INDEX.mask_batch(columns)
+    band = np.asarray(BANDS)[np.searchsorted([25, 50, 75], score, side="left")]
+    return {
+        "score": score,
+        "band": band,
+        "factors": RULE_INDEX.pack(masks, RULE_INDEX.factor_bits),
+        "facts": RULE_INDEX.pack(masks, RULE_INDEX.fact_bits),
+    }
+
+
+def select_stress_facts(intake):
+    """Pick evidence-based stress facts relevant to this person's answers (from STRESS_RULES)."""
+    return RULE_INDEX.facts(intake)[:MAX_FACTS]
+
+
+def questionnaire_analysis(intake):
+    """The full snapshot for a questionnaire check-in, computed locally with no model call.
+
+    Same shape as StressAssistant.analyze_text, with `source` "questionnaire".
+    """
+    score, band, factors = compute_stress_index(intake)
+    return {
+        "source": "questionnaire",
+        "score": score,
+        "factors": factors,
+        "facts": select_stress_facts(intake),
+        "observations": "",
+        "recommendation": BAND_GUIDANCE[band],
+    }
+
+
+# ---------------------- METRICS ----------------------
+# Timing spans around the check-in stages feed per-process latency histograms and counters,
+# exported as Prometheus text on METRICS_PORT (/metrics) and/or appended to the JSON-lines
+# file METRICS_LOG every METRICS_LOG_INTERVAL_S. Each worker process keeps its own numbers,
+# so give each its own port or log. Disabled, spans and counters record nothing.
+METRICS_PORT = int(get_setting("METRICS_PORT", 0))
+METRICS_HOST = str(get_setting("METRICS_HOST", "127.0.0.1"))
+METRICS_LOG = str(get_setting("METRICS_LOG", "")).strip()
+METRICS_LOG_INTERVAL_S = float(get_setting("METRICS_LOG_INTERVAL_S", 60))
+METRICS_ENABLED = get_flag("METRICS_ENABLED", bool(METRICS_PORT or METRICS_LOG))
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _Span:
+    """One timed call, recorded on exit as "success", "fallback" or "error".
+
+    Code inside the span sets `outcome` to "fallback" when it answered from a fallback path
+    (or to "error" for a failure it handled itself); an exception records an "error".
+    """
+
+    __slots__ = ("_metrics", "name", "outcome", "_start")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self.name = name
+        self.outcome = "success"
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or issubclass(exc_type, Exception):
+            outcome = "error" if exc_type else self.outcome
+            self._metrics.observe(self.name, outcome, time.perf_counter() - self._start)
+        # Otherwise a rerun or st.stop cut the call short: it has no outcome, so it is not recorded.
+        return False
+
+
+class _NullSpan:
+    """The span handed out while metrics are disabled: enters, exits and records nothing."""
+
+    __slots__ = ()
+    outcome = property(lambda self: "success", lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """Thread-safe in-process latency histograms (per span and outcome) and labelled counters."""
+
+    def __init__(self, enabled=True, buckets=LATENCY_BUCKETS_S):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}  # (span, outcome) -> [count per bucket..., count above the last, sum]
+        self._counters = {}    # (name, sorted label items) -> value
+
+    def span(self, name):
+        """A context manager timing one call of `name`; an exception records it as an "error"."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, outcome, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._histograms.get((name, outcome))
+            if h is None:
+                h = self._histograms[(name, outcome)] = [0] * (len(self.buckets) + 1) + [0.0]
+            h[i] += 1
+            h[-1] += seconds
+
+    def count(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Everything recorded so far (cumulative), as {"spans": [...], "counters": [...]}."""
+        with self._lock:
+            histograms = {key: list(h) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        bounds = [*map(str, self.buckets), "+Inf"]
+        spans = [
+            {"span": name, "outcome": outcome, "count": sum(h[:-1]), "sum": round(h[-1], 6),
+             "buckets": dict(zip(bounds, itertools.accumulate(h[:-1])))}
+            for (name, outcome), h in sorted(histograms.items())
+        ]
+        return {
+            "spans": spans,
+            "counters": [{"counter": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+        }
+
+    def prometheus(self):
+        """The snapshot in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = ["# HELP stress_app_span_seconds Time spent in each check-in stage, by outcome.",
+                 "# TYPE stress_app_span_seconds histogram"]
+        for s in snap["spans"]:
+            labels = f'span="{s["span"]}",outcome="{s["outcome"]}"'
+            for le, n in s["buckets"].items():
+                lines.append(f'stress_app_span_seconds_bucket{{{labels},le="{le}"}} {n}')
+            lines.append(f"stress_app_span_seconds_sum{{{labels}}} {s['sum']}")
+            lines.append(f"stress_app_span_seconds_count{{{labels}}} {s['count']}")
+        for name, group in itertools.groupby(snap["counters"], key=operator.itemgetter("counter")):
+            lines.append(f"# TYPE stress_app_{name}_total counter")
+            for c in group:
+                labels = ",".join(f'{k}="{v}"' for k, v in c["labels"].items())
+                lines.append(f"stress_app_{name}_total{{{labels}}} {c['value']}")
+        return "\n".join(lines) + "\n"
+
+
+def _serve_metrics(registry, host, port):
+    """Serve registry.prometheus() at http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # One stderr line per scrape is noise.
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _log_metrics(registry, path, interval):
+    """Append a timestamped snapshot to the JSON-lines file at `path` every `interval` seconds."""
+    def run():
+        while True:
+            time.sleep(interval)
+            line = json.dumps({"time": time.time(), "pid": os.getpid(), **registry.snapshot()})
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass  # Losing one snapshot is fine; the next one is cumulative anyway.
+
+    threading.Thread(target=run, name="metrics-log", daemon=True).start()
+
+
+@st.cache_resource
+def metrics():
+    """The process-wide metrics registry; its exporters are started once per process, if configured."""
+    registry = Metrics(enabled=METRICS_ENABLED)
+    if METRICS_ENABLED and METRICS_PORT:
+        try:
+            _serve_metrics(registry, METRICS_HOST, METRICS_PORT)
+        except OSError:
+            pass  # The port is taken (another worker on this host); the JSON-lines log still works.
+    if METRICS_ENABLED and METRICS_LOG:
+        _log_metrics(registry, METRICS_LOG, METRICS_LOG_INTERVAL_S)
+    return registry
+
+
+# ---------------------- CACHING ----------------------
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or total size, with an optional TTL.
+
+    `sizeof` measures each value for the byte budget (defaults to len, suited to bytes).
+    Hit, miss and eviction counters are kept so callers can report a hit rate. With a TTL,
+    expired entries are also swept out (at most every tenth of the TTL), not just skipped.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, size, stored_at)
+        self._swept_at = time.monotonic()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._sweep()
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._sweep()
+            if key in self._data:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # Larger than the whole budget; never worth caching.
+            self._data[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while ((self.max_entries is not None and len(self._data) > self.max_entries)
+                   or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def _sweep(self):
+        now = time.monotonic()
+        if self.ttl is None or now - self._swept_at < self.ttl / 10:
+            return
+        self._swept_at = now
+        for key in [k for k, (_, _, stored_at) in self._data.items() if now - stored_at > self.ttl]:
+            self._drop(key)
+
+    def discard(self, key):
+        """Remove `key` if present."""
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# ---------------------- RESPONSE CACHE ----------------------
+# Bump whenever a prompt or its JSON schema changes, so stale replies are never served.
+PROMPT_VERSION = "1"
+RESPONSE_CACHE_TTL_S = 6 * 60 * 60
+RESPONSE_CACHE_ENTRIES = 2048
+# Optional SQLite file shared by every worker process on the machine ("" keeps it in memory).
+RESPONSE_CACHE_DB = str(get_setting("RESPONSE_CACHE_DB", "")).strip()
+
+
+def normalize_text(text):
+    """Canonical form of a prompt for cache keys: NFC Unicode, collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class ResponseCache:
+    """Memoizes parsed JSON replies from the model, with a TTL and a bounded size.
+
+    A per-process LRU tier is always used; with `db_path`, a SQLite tier is shared by all
+    worker processes, so a reply computed by one worker is an instant hit for the others.
+    """
+
+    def __init__(self, ttl, max_entries, db_path=""):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.shared_hits = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            db = None
+            try:
+                db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS responses "
+                           "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+                self._db = db
+            except sqlite3.Error:
+                # An unwritable path or a database locked by other workers starting up: carry on
+                # with the memory tier alone rather than failing every page.
+                if db is not None:
+                    db.close()
+
+    @staticmethod
+    def key(model, temperature, system, user):
+        payload = json.dumps([PROMPT_VERSION, model, temperature, normalize_text(system), normalize_text(user)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self._db is None:
+            return value
+        try:
+            with self._lock:
+                row = self._db.execute("SELECT value FROM responses WHERE key = ? AND stored_at > ?",
+                                       (key, time.time() - self.ttl)).fetchone()
+        except sqlite3.Error:
+            return None  # The shared tier is best-effort.
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self.shared_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self._db is None:
+            return
+        try:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), time.time()))
+                # Expire old rows and keep only the newest max_entries.
+                self._db.execute("DELETE FROM responses WHERE stored_at <= ? OR key IN (SELECT key FROM "
+                                 "responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                                 (time.time() - self.ttl, self.max_entries))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["shared_hits"] = self.shared_hits
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + self.shared_hits) / lookups if lookups else 0.0
+        return stats
+
+
+@st.cache_resource
+def response_cache():
+    """The process-wide model response cache (backed by SQLite when RESPONSE_CACHE_DB is set)."""
+    return ResponseCache(RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_DB)
+
+
+# ---------------------- TRANSCRIPT CACHE ----------------------
+TRANSCRIPT_CACHE_ENTRIES = 4096
+# Kept short: these are transcripts of people's voices, held across sessions only so that a
+# recording sent again soon (Back then Continue, a retried batch item) is not re-transcribed.
+TRANSCRIPT_CACHE_TTL_S = 10 * 60
+TRANSCRIPT_SESSION_ENTRIES = 16
+
+
+class TranscriptCache:
+    """Transcripts keyed by a digest of the audio bytes, so a recording is transcribed only once.
+
+    Lookups try the session's own tier first, then the process-wide tier shared by all
+    sessions. Both tiers are LRUCaches, so their hit/miss counters give the hit rate.
+    """
+
+    def __init__(self, session_tier, shared_tier):
+        self.session = session_tier
+        self.shared = shared_tier
+
+    @staticmethod
+    def key(audio_bytes, model):
+        return hashlib.sha256(model.encode() + b"\0" + audio_bytes).hexdigest()
+
+    def get(self, key):
+        text = self.session.get(key)
+        if text is None:
+            text = self.shared.get(key)
+            if text is not None:
+                self.session.put(key, text)
+        return text
+
+    def put(self, key, text):
+        self.session.put(key, text)
+        self.shared.put(key, text)
+
+
+@st.cache_resource
+def shared_transcripts():
+    """The process-wide transcript tier, shared by every session."""
+    return LRUCache(max_entries=TRANSCRIPT_CACHE_ENTRIES, ttl=TRANSCRIPT_CACHE_TTL_S)
+
+
+def session_transcripts():
+    """This session's transcript tier (kept in session state, so it ends with the session)."""
+    if "transcripts" not in st.session_state:
+        st.session_state.transcripts = LRUCache(max_entries=TRANSCRIPT_SESSION_ENTRIES)
+    return st.session_state.transcripts
+
+
+def forget_session_transcripts():
+    """Drop this session's transcripts from the shared tier too (on logout)."""
+    session = st.session_state.get("transcripts")
+    if session is not None:
+        shared = shared_transcripts()
+        for key in session.keys():
+            shared.discard(key)
+
+
+# ---------------------- BACKGROUND WORKERS ----------------------
+# Threads shared by all sessions for concurrent model and TTS calls. This also bounds how
+# many of those calls a single process has in flight at once.
+WORKER_THREADS = 16
+# Seconds to wait for a follow-up answer's transcript before giving up on it.
+TRANSCRIBE_TIMEOUT_S = 30
+
+
+@st.cache_resource
+def worker_pool():
+    """The process-wide thread pool for work a person is waiting on (shared across sessions)."""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="stress-worker")
+
+
+@st.cache_resource
+def background_pool():
+    """The process-wide thread pool for background model calls (speculative analysis, enrichment).
+
+    Kept apart from worker_pool, so background jobs waiting for a model gate slot queue here
+    instead of holding threads that interactive calls and speech synthesis need. It has one
+    thread per background slot of the gate, so a thread is rarely idle waiting on the gate.
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=GEMINI_BACKGROUND_MAX_IN_FLIGHT,
+                                                 thread_name_prefix="stress-background")
+
+
+# ---------------------- SHARED GEMINI CLIENT ----------------------
+# HTTP connection pool settings for the process-wide client; idle connections are kept
+# alive so back-to-back calls skip the TCP/TLS handshake.
+GEMINI_MAX_CONNECTIONS = 20
+GEMINI_KEEPALIVE_SECONDS = 120
+# Consecutive failed calls after which the shared client is torn down and rebuilt.
+GEMINI_REBUILD_AFTER_FAILURES = 3
+# Per-operation deadlines: the total time one call may take, retries included.
+GEMINI_DEADLINES_S = {"json": 20, "stream": 30, "transcribe": 30}
+# Attempts per call on retryable errors, with full-jitter exponential backoff between them.
+GEMINI_MAX_ATTEMPTS = 3
+GEMINI_BACKOFF_BASE_S = 0.5
+GEMINI_BACKOFF_MAX_S = 4
+# HTTP statuses worth retrying: timeouts, rate limiting and server-side failures.
+GEMINI_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Consecutive backend failures that open the circuit, and how long it stays open before a probe.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN_S = 30
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a failing backend so every session goes straight to its fallback.
+
+    "closed": calls flow. After BREAKER_FAILURE_THRESHOLD consecutive backend failures it
+    turns "open" and rejects calls for the cooldown. Then it is "half-open": one probe call is
+    let through, and its outcome closes the circuit again or re-opens it for another cooldown.
+    A probe that ends without an outcome is handed back with abandon(), and one that never
+    reports at all lapses after a cooldown, so the circuit cannot stay half-open for good.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_S):
+        self._lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a call may go ahead now: "probe" for the half-open probe, True for any other
+        allowed call, False (counted as rejected) otherwise."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "half-open" and now >= self.probe_at + self.cooldown:
+                self.state = "open"  # The probe never reported back; let another through.
+            if self.state == "open" and now >= self.opened_at + self.cooldown:
+                self.state = "half-open"
+                self.probe_at = now
+                return "probe"
+            if self.state == "closed":
+                return True
+            self.rejected += 1
+            return False
+
+    def abandon(self):
+        """Hand back a probe that ended without an outcome, so the next call probes instead."""
+        with self._lock:
+            if self.state == "half-open":
+                self.state = "open"
+
+    def record(self, backend_ok):
+        """Record a call's outcome: whether the backend answered (even with a client error)."""
+        with self._lock:
+            if backend_ok:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def retry_in(self):
+        """Seconds until an open circuit lets a probe through (0 unless open)."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+
+def _is_retryable(error):
+    """Transient failures worth another attempt: dropped connections, timeouts, 429 and 5xx."""
+    if isinstance(error, genai_errors.APIError):
+        return error.code in GEMINI_RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX_S, GEMINI_BACKOFF_BASE_S * 2 ** (attempt - 1)))
+
+
+def _with_timeout(request, deadline):
+    """A copy of generate_content kwargs whose HTTP timeout is the time left before `deadline`."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Gemini call ran out of time before it could be sent.")
+    config = request.get("config") or genai_types.GenerateContentConfig()
+    http_options = genai_types.HttpOptions(timeout=max(1, int(remaining * 1000)))  # milliseconds
+    return dict(request, config=config.model_copy(update={"http_options": http_options}))
+
+
+class GeminiClientPool:
+    """One Gemini client per process, shared by every session.
+
+    The client (and its HTTP connection pool) is built on first use and then reused across
+    reruns and sessions. It is rebuilt only when the API key changes or after several
+    consecutive calls have failed. All state changes are guarded by a lock. The pool also
+    owns the process-wide circuit breaker, fed by record_success / record_failure.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._api_key = None
+        self.builds = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.breaker = CircuitBreaker()
+
+    def get(self, api_key):
+        """Return the shared client for this key, building or rebuilding it if needed."""
+        with self._lock:
+            if (self._client is None or api_key != self._api_key
+                    or self.consecutive_failures >= GEMINI_REBUILD_AFTER_FAILURES):
+                self._build(api_key)
+            return self._client
+
+    def _build(self, api_key):
+        # Drop the old client rather than closing it: other sessions may still be mid-call.
+        self._client = None
+        self._client = genai.Client(
+            api_key=api_key,
+            http_options=genai_types.HttpOptions(client_args={
+                "limits": httpx.Limits(
+                    max_connections=GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+                    keepalive_expiry=GEMINI_KEEPALIVE_SECONDS,
+                ),
+            }),
+        )
+        self._api_key = api_key
+        self.builds += 1
+        self.consecutive_failures = 0
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+        self.breaker.record(True)
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error
+        if isinstance(error, genai_errors.APIError) and error.code == 429:
+            # Rate limiting is the call gate's to handle (it throttles); the backend itself is up,
+            # so this says nothing either way about the circuit. An unsettled probe is abandoned.
+            return
+        # Only failures that say the backend is unwell count towards opening the circuit.
+        self.breaker.record(not _is_retryable(error))
+
+    @property
+    def healthy(self):
+        return self._client is not None and self.consecutive_failures == 0 and self.breaker.state == "closed"
+
+
+@st.cache_resource
+def gemini_pool():
+    """The process-wide Gemini client pool, created once and shared across sessions."""
+    return GeminiClientPool()
+
+
+# ---------------------- MODEL CALL GATE ----------------------
+# Process-wide limits on outbound Gemini calls, shared by every session: a token bucket for the
+# request rate and a cap on calls in flight, with background work capped lower still.
+GEMINI_RATE_PER_S = float(get_setting("GEMINI_RATE_PER_S", 5))
+GEMINI_BURST = int(get_setting("GEMINI_BURST", 10))
+GEMINI_MAX_IN_FLIGHT = int(get_setting("GEMINI_MAX_IN_FLIGHT", 8))
+GEMINI_BACKGROUND_MAX_IN_FLIGHT = max(1, GEMINI_MAX_IN_FLIGHT // 2)
+# Priority classes, most urgent first: someone waiting on the screen, then speculative or
+# enrichment work nobody is waiting on yet.
+PRIORITIES = ("interactive", "background")
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class ModelCallGate:
+    """Admits outbound model calls under a rate limit and a concurrency limit.
+
+    Waiting calls are served strictly by priority class and, within a class, round-robin across
+    sessions, so one busy session cannot starve the others. A 429 from the backend empties the
+    bucket so every session backs off together. All state is guarded by one condition variable.
+    """
+
+    def __init__(self, rate=GEMINI_RATE_PER_S, burst=GEMINI_BURST, max_in_flight=GEMINI_MAX_IN_FLIGHT,
+                 background_max_in_flight=GEMINI_BACKGROUND_MAX_IN_FLIGHT):
+        self._cond = threading.Condition()
+        self.rate = rate
+        self.burst = burst
+        self.limits = {"interactive": max_in_flight, "background": min(background_max_in_flight, max_in_flight)}
+        self.tokens = float(burst)
+        self._refilled = time.monotonic()
+        self.in_flight = dict.fromkeys(PRIORITIES, 0)
+        self._waiting = {p: OrderedDict() for p in PRIORITIES}  # session -> deque of tickets
+        self.granted = dict.fromkeys(PRIORITIES, 0)
+        self.timeouts = 0
+        self.max_queued = 0
+        self._wait_s = 0.0
+
+    def acquire(self, session, priority, deadline):
+        """Block until a call may start; raise TimeoutError if that is not before `deadline`."""
+        ticket = _Ticket()
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority].setdefault(session, deque()).append(ticket)
+            self.max_queued = max(self.max_queued, self._queued())
+            while True:
+                self._dispatch()
+                if ticket.granted:
+                    self._wait_s += time.monotonic() - start
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    tickets = self._waiting[priority][session]
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del self._waiting[priority][session]
+                    self.timeouts += 1
+                    raise TimeoutError("Timed out waiting for a free model call slot.")
+                self._cond.wait(min(remaining, self._until_token()))
+
+    def release(self, priority):
+        with self._cond:
+            self.in_flight[priority] -= 1
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, session, priority, deadline):
+        """Hold one call slot for the duration of the block."""
+        self.acquire(session, priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def throttle(self):
+        """The backend said we are going too fast (429): spend the bucket so everyone slows down."""
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _until_token(self):
+        return 0.05 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def _dispatch(self):
+        """Grant waiting tickets while there are tokens and free slots. Call with the lock held."""
+        self._refill()
+        granted = False
+        while self.tokens >= 1 and sum(self.in_flight.values()) < self.limits["interactive"]:
+            for priority in PRIORITIES:
+                sessions = self._waiting[priority]
+                if sessions and self.in_flight[priority] < self.limits[priority]:
+                    break
+            else:
+                break
+            # Round-robin: serve the longest-waiting session, then send it to the back of the line.
+            session, tickets = next(iter(sessions.items()))
+            tickets.popleft().granted = True
+            del sessions[session]
+            if tickets:
+                sessions[session] = tickets
+            self.tokens -= 1
+            self.in_flight[priority] += 1
+            self.granted[priority] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _queued(self, priority=None):
+        priorities = PRIORITIES if priority is None else (priority,)
+        return sum(len(q) for p in priorities for q in self._waiting[p].values())
+
+    def stats(self):
+        with self._cond:
+            total = sum(self.granted.values())
+            return {
+                "in_flight": sum(self.in_flight.values()),
+                "queued": {p: self._queued(p) for p in PRIORITIES},
+                "max_queued": self.max_queued,
+                "granted": dict(self.granted),
+                "timeouts": self.timeouts,
+                "avg_wait_ms": self._wait_s / total * 1000 if total else 0.0,
+            }
+
+
+@st.cache_resource
+def model_gate():
+    """The process-wide gate every outbound Gemini call goes through."""
+    return ModelCallGate()
+
+
+def session_id():
+    """A random id for this browser session, used to queue its model calls fairly."""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = os.urandom(8).hex()
+    return st.session_state.session_id
+
+
+# ---------------------- TOKEN BUDGETS ----------------------
+# Every Gemini call's prompt, output and audio tokens (from its usage metadata) and request bytes
+# are summed per session, per user and for the process, each over a rolling window. Budgets are
+# in prompt plus output tokens (0: no budget). Once any budget that applies is BUDGET_REDUCE_AT
+# used, outputs are trimmed and background calls skipped; once one is spent, follow-ups,
+# analysis and guidance come from the local fallbacks. Transcription, without which a recording
+# is lost, still goes out.
+SESSION_TOKEN_BUDGET = int(get_setting("SESSION_TOKEN_BUDGET", 0))
+USER_TOKEN_BUDGET = int(get_setting("USER_TOKEN_BUDGET", 0))
+PROCESS_TOKEN_BUDGET = int(get_setting("PROCESS_TOKEN_BUDGET", 0))
+TOKEN_BUDGET_WINDOW_S = float(get_setting("TOKEN_BUDGET_WINDOW_S", 60 * 60))
+BUDGET_REDUCE_AT = 0.8
+BUDGET_REDUCED_OUTPUT = 0.6  # share of max_output_tokens kept once a budget is nearly spent
+BUDGET_LEVELS = ("normal", "reduced", "exhausted")
+USAGE_FIELDS = ("calls", "prompt_tokens", "output_tokens", "audio_tokens", "request_bytes")
+USAGE_TRACKED_KEYS = 10000  # sessions and users tracked at once; the least recently active go first
+# Recordings larger than this are refused before any decoding or upload.
+MAX_RECORDING_BYTES = int(get_setting("MAX_RECORDING_BYTES", 20 * 1024 * 1024))
+
+
+class BudgetExhausted(BackendUnavailable):
+    """Raised instead of calling Gemini once a token budget that applies is spent."""
+
+
+class RecordingTooLarge(ValueError):
+    """Raised instead of processing a recording over MAX_RECORDING_BYTES."""
+
+
+def check_recording_size(audio_bytes):
+    if len(audio_bytes) > MAX_RECORDING_BYTES:
+        raise RecordingTooLarge(f"Recording is {len(audio_bytes) / 2**20:.1f} MB; "
+                                f"the limit is {MAX_RECORDING_BYTES / 2**20:.0f} MB.")
+
+
+class UsageLedger:
+    """Thread-safe token and payload totals per session, per user and for the process.
+
+    Each total covers a rolling window: it starts over at the first call made `window_s` or
+    more after the window opened. level() measures the totals against `budgets`, a dict of
+    token budgets by scope ("session", "user", "process"), where 0 means no budget.
+    """
+
+    def __init__(self, budgets, window_s=TOKEN_BUDGET_WINDOW_S, max_keys=USAGE_TRACKED_KEYS):
+        self.budgets = budgets
+        self.window_s = window_s
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._totals = OrderedDict()  # (scope, key) -> [window start, *USAGE_FIELDS]
+
+    @staticmethod
+    def _scopes(session, user):
+        yield "process", None
+        if session:
+            yield "session", session
+        if user:
+            yield "user", user
+
+    def record(self, session, user, **amounts):
+        """Add `amounts` (keyed by USAGE_FIELDS) to the process, the session and the user."""
+        now = time.monotonic()
+        with self._lock:
+            for key in self._scopes(session, user):
+                entry = self._totals.get(key)
+                if entry is None or now - entry[0] >= self.window_s:
+                    entry = self._totals[key] = [now] + [0] * len(USAGE_FIELDS)
+                self._totals.move_to_end(key)
+                for i, field in enumerate(USAGE_FIELDS, 1):
+                    entry[i] += amounts.get(field, 0)
+            while len(self._totals) > self.max_keys:
+                self._totals.popitem(last=False)
+
+    def totals(self, scope, key=None):
+        """The current window's totals for one scope ("process", or "session"/"user" with its key)."""
+        with self._lock:
+            entry = self._totals.get((scope, key))
+            if entry is None or time.monotonic() - entry[0] >= self.window_s:
+                return dict.fromkeys(USAGE_FIELDS, 0)
+            return dict(zip(USAGE_FIELDS, entry[1:]))
+
+    def level(self, session, user):
+        """The tightest budget's state (see BUDGET_LEVELS): "reduced" from BUDGET_REDUCE_AT used."""
+        used = 0.0
+        for scope, key in self._scopes(session, user):
+            budget = self.budgets.get(scope)
+            if budget:
+                t = self.totals(scope, key)
+                used = max(used, (t["prompt_tokens"] + t["output_tokens"]) / budget)
+        if used >= 1:
+            return "exhausted"
+        return "reduced" if used >= BUDGET_REDUCE_AT else "normal"
+
+
+@st.cache_resource
+def usage_ledger():
+    """The process-wide ledger every Gemini call's usage is recorded in."""
+    return UsageLedger({"session": SESSION_TOKEN_BUDGET, "user": USER_TOKEN_BUDGET,
+                        "process": PROCESS_TOKEN_BUDGET})
+
+
+def _usage_tokens(usage):
+    """(prompt, output, audio) token counts from a response's usage metadata (zeros if absent)."""
+    if usage is None:
+        return 0, 0, 0
+    audio = sum(d.token_count or 0 for d in usage.prompt_tokens_details or []
+                if getattr(d.modality, "value", d.modality) == "AUDIO")
+    output = (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)
+    return usage.prompt_token_count or 0, output, audio
+
+
+def _request_bytes(request):
+    """Approximate upload size of a generate_content request: its text, inline audio and system prompt."""
+    contents = request.get("contents")
+    total = 0
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, str):
+            total += len(part.encode())
+        else:
+            total += len(getattr(getattr(part, "inline_data", None), "data", None) or b"")
+    system = getattr(request.get("config"), "system_instruction", None)
+    if isinstance(system, str):
+        total += len(system.encode())
+    return total
+
+
+# ---------------------- STREAMING JSON ----------------------
+class JSONStreamParser:
+    """Incrementally parse a JSON object arriving in chunks.
+
+    feed() returns the events completed by that chunk, in order: ("item", key, value) for each
+    element of a top-level array as soon as the element is complete, and ("field", key, value)
+    for each top-level field once its whole value is complete.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None  # start of the current top-level "key": value member
+        self._value_start = None   # start of the current top-level value
+        self._item_start = None    # start of the current element when that value is an array
+        self._key = None
+
+    def feed(self, chunk):
+        self._buf += chunk
+        events = []
+        for i in range(self._pos, len(self._buf)):
+            c = self._buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                if self._depth == 0:
+                    self._member_start = i + 1
+                elif (self._depth == 1 and c == "["
+                        and self._value_start is not None and not self._buf[self._value_start:i].strip()):
+                    self._item_start = i + 1
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    self._emit_item(events, i)
+                    self._item_start = None
+                elif self._depth == 0:
+                    self._emit_field(events, i)
+            elif c == ":" and self._depth == 1 and self._value_start is None:
+                self._key = json.loads(self._buf[self._member_start:i])
+                self._value_start = i + 1
+            elif c == "," and self._depth == 1:
+                self._emit_field(events, i)
+                self._member_start = i + 1
+            elif c == "," and self._depth == 2 and self._item_start is not None:
+                self._emit_item(events, i)
+                self._item_start = i + 1
+        self._pos = len(self._buf)
+        return events
+
+    def _emit_item(self, events, end):
+        raw = self._buf[self._item_start:end].strip()
+        if raw:
+            events.append(("item", self._key, json.loads(raw)))
+
+    def _emit_field(self, events, end):
+        if self._value_start is not None:
+            events.append(("field", self._key, json.loads(self._buf[self._value_start:end])))
+        self._key = self._value_start = None
+
+    @property
+    def text(self):
+        return self._buf
+
+
+# ---------------------- AUDIO PREPROCESSING ----------------------
+# Recordings are shrunk before upload: mono, resampled to a speech rate, edge silence trimmed,
+# then re-encoded. "flac" is lossless; "opus" is a far smaller speech codec (audio/ogg).
+AUDIO_PREPROCESSING = get_flag("AUDIO_PREPROCESSING", True)
+AUDIO_UPLOAD_CODEC = str(get_setting("AUDIO_UPLOAD_CODEC", "flac")).lower()
+SPEECH_SAMPLE_RATE = 16000
+SILENCE_FRAME_MS = 20
+SILENCE_THRESHOLD_DB = -35  # frames this far below the loudest frame count as silence
+SILENCE_FLOOR_DBFS = -55    # ... as do frames quieter than this, however quiet the clip is
+SILENCE_PAD_MS = 200        # kept either side of the speech so words are not clipped
+UPLOAD_CODECS = {
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg"),
+}
+
+
+def _resample(samples, src_rate, dst_rate):
+    """Band-limited FFT resampling (the spectrum is truncated, so downsampling does not alias)."""
+    if src_rate == dst_rate or samples.size == 0:
+        return samples
+    n_out = max(1, int(round(samples.size * dst_rate / src_rate)))
+    return (np.fft.irfft(np.fft.rfft(samples), n_out) * (n_out / samples.size)).astype(np.float32)
+
+
+def _trim_silence(samples, rate):
+    """Drop leading and trailing silence using per-frame energy; returns the clip unchanged if all quiet."""
+    frame = max(1, rate * SILENCE_FRAME_MS // 1000)
+    n_frames = samples.size // frame
+    if n_frames == 0:
+        return samples
+    energy = np.square(samples[:n_frames * frame].reshape(n_frames, frame)).mean(axis=1)
+    db = 10 * np.log10(energy + 1e-12)
+    threshold = max(db.max() + SILENCE_THRESHOLD_DB, SILENCE_FLOOR_DBFS)
+    voiced = np.flatnonzero(db > threshold)
+    if voiced.size == 0:
+        return samples
+    pad = rate * SILENCE_PAD_MS // 1000
+    start = max(0, voiced[0] * frame - pad)
+    end = min(samples.size, (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def preprocess_audio(audio_bytes, mime_type="audio/wav"):
+    """Shrink a recording for transcription and return (audio_bytes, mime_type).
+
+    Downmixes to mono, resamples to SPEECH_SAMPLE_RATE, trims edge silence and re-encodes
+    with AUDIO_UPLOAD_CODEC. Anything soundfile cannot decode, or cannot encode (such as Opus on
+    a libsndfile built without it), is passed through unchanged.
+    """
+    try:
+        data, rate = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+    except Exception:
+        return audio_bytes, mime_type
+    samples = _trim_silence(_resample(data.mean(axis=1), rate, SPEECH_SAMPLE_RATE), SPEECH_SAMPLE_RATE)
+    container, subtype, out_mime = UPLOAD_CODECS.get(AUDIO_UPLOAD_CODEC, UPLOAD_CODECS["flac"])
+    buf = io.BytesIO()
+    try:
+        sf.write(buf, np.clip(samples, -1.0, 1.0), SPEECH_SAMPLE_RATE, format=container, subtype=subtype)
+    except Exception:
+        return audio_bytes, mime_type
+    return buf.getvalue(), out_mime
+
+
+# ---------------------- LOCAL TEXT SCORER ----------------------
+# A weighted stress lexicon for scoring text on-device, with no model call. Each category is
+# (factor label, label of the STRESS_RULES fact that fits it, {word: weight}). Negative weights mark
+# calming language. A word right after a negation ("not stressed") counts against the score.
+STRESS_LEXICON = {
+    "overwhelm": ("Feeling overwhelmed", "control", {
+        "stressed": 2, "stressful": 2, "overwhelmed": 3, "overwhelming": 3, "pressure": 2, "swamped": 2,
+        "drowning": 3, "burnout": 3, "burnt": 2, "frazzled": 2, "chaos": 2, "chaotic": 2, "stress": 1,
+    }),
+    "anxiety": ("Worry and anxiety", "adrenaline", {
+        "anxious": 3, "anxiety": 3, "panic": 3, "panicking": 3, "dread": 3, "worried": 2, "worry": 2,
+        "worrying": 2, "nervous": 2, "scared": 2, "afraid": 2, "fear": 2, "restless": 1, "uneasy": 1,
+    }),
+    "mood": ("Low mood", None, {
+        "hopeless": 3, "miserable": 3, "sad": 2, "upset": 2, "angry": 2, "frustrated": 2, "irritable": 2,
+        "lonely": 2, "crying": 2, "numb": 2, "down": 1, "alone": 1,
+    }),
+    "sleep": ("Sleep and energy", "sleep", {
+        "insomnia": 3, "sleepless": 3, "exhausted": 2, "tired": 2, "nightmares": 2, "drained": 2,
+        "awake": 1, "sleep": 1,
+    }),
+    "work": ("Work or study pressure", "chronic", {
+        "deadline": 2, "deadlines": 2, "exam": 2, "exams": 2, "workload": 2, "overtime": 2, "work": 1,
+        "job": 1, "boss": 1, "study": 1, "project": 1,
+    }),
+    "money": ("Money worries", "chronic", {
+        "debt": 3, "bills": 2, "rent": 2, "broke": 2, "afford": 2, "money": 1, "finances": 1, "financial": 1,
+        "loan": 1,
+    }),
+    "relationships": ("Relationship strain", None, {
+        "breakup": 3, "divorce": 3, "argument": 2, "arguing": 2, "fight": 2, "conflict": 2, "partner": 1,
+        "family": 1,
+    }),
+    "body": ("Physical signs of stress", "tension", {
+        "headache": 2, "headaches": 2, "tense": 2, "tension": 2, "shaking": 2, "heart": 1, "racing": 1,
+        "chest": 1, "stomach": 1,
+    }),
+    "calm": ("", None, {
+        "relaxed": -3, "peaceful": -3, "calm": -2, "relaxing": -2, "great": -2, "happy": -2, "rested": -2,
+        "grateful": -2, "content": -2, "fine": -1, "okay": -1, "good": -1, "better": -1,
+    }),
+}
+NEGATIONS = {"not", "no", "never", "don't", "dont", "isn't", "wasn't", "haven't", "without", "hardly"}
+LEXICON_SCALE = 8.0   # raw lexicon weight that moves the score about three quarters of the way to 0 or 100
+LEXICON_FACTORS = 3   # most heavily weighted categories reported as factors
+
+
+class LexiconScorer:
+    """STRESS_LEXICON compiled into NumPy arrays; analyze() scores a text in microseconds.
+
+    The text is tokenized once, every token is mapped to its lexicon entry in one pass, and the
+    per-category totals come from a single weighted bincount.
+    """
+
+    def __init__(self, lexicon):
+        self.labels = [label for label, _, _ in lexicon.values()]
+        facts = {rule.label: rule.text for rule in STRESS_RULES if rule.kind == "fact"}
+        self.facts = [facts[fact] if fact else None for _, fact, _ in lexicon.values()]
+        self.closing_fact = next(rule.text for rule in STRESS_RULES if rule.op == "always" and rule.kind == "fact")
+        self.vocab = {}
+        weights, categories = [], []
+        for category, (_, _, terms) in enumerate(lexicon.values()):
+            for term, weight in terms.items():
+                self.vocab[term] = len(weights)
+                weights.append(weight)
+                categories.append(category)
+        self.terms = list(self.vocab)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.categories = np.asarray(categories, dtype=np.int64)
+
+    def analyze(self, text):
+        """A snapshot estimated from the words alone, shaped like analyze_text's, with `source` "local"."""
+        tokens = re.findall(r"[a-z']+", (text or "").lower())
+        ids = np.fromiter(map(self.vocab.get, tokens, itertools.repeat(-1)), dtype=np.int64, count=len(tokens))
+        negation = np.fromiter(map(NEGATIONS.__contains__, tokens), dtype=bool, count=len(tokens))
+        negated = np.zeros(len(tokens), dtype=bool)
+        negated[1:] |= negation[:-1]
+        negated[2:] |= negation[:-2]  # "not very stressed"
+
+        hit = ids >= 0
+        ids, negated = ids[hit], negated[hit]
+        weights = np.where(negated, -0.5 * self.weights[ids], self.weights[ids])
+        totals = np.bincount(self.categories[ids], weights=weights, minlength=len(self.labels))
+        score = int(np.clip(np.round(50 + 45 * np.tanh(totals.sum() / LEXICON_SCALE)), 0, 100))
+
+        factors, facts = [], []
+        for category in np.argsort(-totals, kind="stable")[:LEXICON_FACTORS]:
+            if totals[category] <= 0:
+                break
+            mentioned = dict.fromkeys(self.terms[i] for i in ids[(self.categories[ids] == category) & ~negated])
+            factors.append((self.labels[category], f"You mentioned: {', '.join(list(mentioned)[:3])}."))
+            fact = self.facts[category]
+            if fact and fact not in facts:
+                facts.append(fact)
+        facts = (facts + [self.closing_fact])[:MAX_FACTS]
+        if not factors:
+            factors = [("Based on what you shared", "No strong signs of stress stood out in your words.")]
+        return {
+            "source": "local",
+            "score": score,
+            "factors": factors,
+            "facts": facts,
+            "observations": "",
+            "recommendation": BAND_GUIDANCE[band_for_score(score)],
+        }
+
+
+@st.cache_resource
+def lexicon_scorer():
+    return LexiconScorer(STRESS_LEXICON)
+
+
+# ---------------------- AI ASSISTANT ----------------------
+# "pipeline" transcribes each recording separately and then analyzes the text; "multimodal"
+# sends the recordings straight to the model, which transcribes and analyzes in one request.
+ANALYSIS_MODE = str(get_setting("ANALYSIS_MODE", "pipeline")).lower()
+# How long analyze_text waits for the model before answering with the local scorer's estimate.
+ANALYSIS_DEADLINE_S = float(get_setting("ANALYSIS_DEADLINE_S", 8))
+
+COACH_PERSONA = "You are a warm, evidence-based stress-management coach."
+ANALYSIS_FIELDS = (
+    '"score": <integer 0-100 estimating their current stress level>, '
+    '"factors": [{"label": "<short label>", "detail": "<one supportive sentence>"}], '
+    '"facts": ["<evidence-based stress fact relevant to what they said>"], '
+    '"observations": "<at most 2 supportive, specific sentences reflecting what stands out>", '
+    '"recommendation": "<exactly 2 short, practical, doable sentences>"'
+)
+ANALYSIS_RULES = "Provide 2 to 4 factors and 2 to 4 facts. No markdown, no medical claims."
+
+# Asked when the assistant is offline or has nothing to go on; their speech is pre-synthesized
+# at startup so the offline path adds no TTS wait.
+FALLBACK_QUESTIONS = (
+    "What is weighing on you the most right now?",
+    "Has anything helped you feel even a little steadier lately?",
+)
+
+
+class StressAssistant:
+    def __init__(self):
+        self.client = None
+        self.pool = None
+        self.responses = response_cache()
+        self.transcripts = TranscriptCache(session_transcripts(), shared_transcripts())
+        self.scorer = lexicon_scorer()
+        self.gate = model_gate()
+        self.session = session_id()
+        self.metrics = metrics()
+        self.usage = usage_ledger()
+        self.user = st.session_state.get("username")
+        self.multimodal = ANALYSIS_MODE == "multimodal"
+        self._setup()
+
+    def _setup(self):
+        """Attach to the shared Gemini client (Streamlit secret, then env var, then hardcoded fallback)."""
+        with self.metrics.span("assistant_setup") as span:
+            try:
+                api_key = get_api_key()
+
+                if not api_key or api_key == "YOUR_GEMINI_API_KEY":
+                    st.sidebar.error("GEMINI_API_KEY not set. Add it in Streamlit Secrets or set the env var.")
+                    span.outcome = "fallback"
+                    return
+
+                self.pool = gemini_pool()
+                self.client = self.pool.get(api_key)
+                self.model = GEMINI_TEXT_MODEL
+                if self.pool.breaker.state == "open":
+                    span.outcome = "fallback"
+                    st.sidebar.warning("Assistant paused after repeated failures, so offline answers are used. "
+                                       f"Retrying in {self.pool.breaker.retry_in():.0f} s.")
+                elif self.pool.healthy:
+                    st.sidebar.success("Assistant connected")
+                else:
+                    st.sidebar.warning("Assistant connected, but recent requests failed.")
+                level = self.budget_level()
+                if level == "exhausted":
+                    span.outcome = "fallback"
+                    st.sidebar.info("Usage limit reached for now, so quick offline answers are used.")
+                elif level == "reduced":
+                    st.sidebar.info("Nearing the usage limit, so answers are kept brief.")
+            except Exception as e:
+                self.client = None
+                span.outcome = "error"
+                st.sidebar.error("Assistant offline (Gemini init failed).")
+                st.sidebar.write(e)
+
+    def _generate(self, operation="json", priority="interactive", **kwargs):
+        """Call generate_content on the shared client within the operation's deadline.
+
+        Every attempt first takes a slot from the process-wide model gate at `priority`.
+        Retryable errors are retried (up to GEMINI_MAX_ATTEMPTS, with jittered backoff) while
+        the deadline allows; each attempt's outcome feeds the pool's health and circuit breaker.
+        Raises BackendUnavailable without calling out while the circuit is open.
+        """
+        deadline = time.monotonic() + GEMINI_DEADLINES_S[operation]
+        for attempt in itertools.count(1):
+            with self._circuit_attempt():
+                with self.gate.slot(self.session, priority, deadline):
+                    request = _with_timeout(kwargs, deadline)
+                    try:
+                        resp = self.client.models.generate_content(**request)
+                        error = None
+                    except Exception as e:
+                        error = e
+                self._account(request, resp.usage_metadata if error is None else None)
+                self.metrics.count("gemini_attempts", operation=operation, outcome="error" if error else "success")
+                if error is None:
+                    self.pool.record_success()
+                    return resp
+                self._record_failure(error)
+            self._pause_before_retry(error, attempt, deadline)
+
+    def _generate_stream(self, operation="stream", priority="interactive", **kwargs):
+        """Like _generate, but yield the text of each chunk as generate_content_stream produces it.
+
+        A stream holds its gate slot until it ends. It is only retried if it failed before its
+        first chunk, and it is abandoned with TimeoutError once the deadline passes, however
+        steadily chunks are still arriving.
+        """
+        deadline = time.monotonic() + GEMINI_DEADLINES_S[operation]
+        for attempt in itertools.count(1):
+            started, error, usage = False, None, None
+            with self._circuit_attempt():
+                with self.gate.slot(self.session, priority, deadline):
+                    request = _with_timeout(kwargs, deadline)
+                    try:
+                        for chunk in self.client.models.generate_content_stream(**request):
+                            if time.monotonic() > deadline:
+                                raise TimeoutError(
+                                    f"Gemini stream ran past its {GEMINI_DEADLINES_S[operation]} s deadline.")
+                            started = True
+                            usage = chunk.usage_metadata or usage  # Complete on the final chunk.
+                            yield chunk.text or ""
+                    except Exception as e:
+                        error = e
+                self._account(request, usage)
+                self.metrics.count("gemini_attempts", operation=operation, outcome="error" if error else "success")
+                if error is None:
+                    self.pool.record_success()
+                    return
+                self._record_failure(error)
+            if started:
+                raise error
+            self._pause_before_retry(error, attempt, deadline)
+
+    def budget_level(self):
+        """Where this session, its user and the process stand against their token budgets."""
+        return self.usage.level(self.session, self.user)
+
+    def _account(self, request, usage):
+        """Record one attempt's request bytes and (if it returned any) token usage."""
+        prompt, output, audio = _usage_tokens(usage)
+        sent = _request_bytes(request)
+        self.usage.record(self.session, self.user, calls=1, prompt_tokens=prompt, output_tokens=output,
+                          audio_tokens=audio, request_bytes=sent)
+        for kind, tokens in (("prompt", prompt), ("output", output), ("audio", audio)):
+            self.metrics.count("gemini_tokens", tokens, kind=kind)
+        self.metrics.count("gemini_request_bytes", sent)
+
+    def _record_failure(self, error):
+        self.pool.record_failure(error)
+        if isinstance(error, genai_errors.APIError) and error.code == 429:
+            self.gate.throttle()
+
+    @contextlib.contextmanager
+    def _circuit_attempt(self):
+        """One attempt past the circuit breaker, which the body reports on.
+
+        Raises BackendUnavailable while the circuit is open. If this attempt is the half-open
+        probe and ends before reporting (a gate or deadline timeout, or a stream closed by its
+        consumer), the probe is handed back rather than left outstanding.
+        """
+        breaker = self.pool.breaker
+        probe = breaker.allow()
+        if not probe:
+            raise BackendUnavailable(
+                f"Assistant paused after repeated failures; retrying in {breaker.retry_in():.0f} s.")
+        try:
+            yield
+        finally:
+            if probe == "probe":
+                breaker.abandon()  # A no-op once the probe's outcome has closed or re-opened it.
+
+    @staticmethod
+    def _pause_before_retry(error, attempt, deadline):
+        """Sleep before the next attempt, or re-raise `error` when it should not be retried."""
+        delay = _backoff(attempt)
+        if attempt >= GEMINI_MAX_ATTEMPTS or not _is_retryable(error) or time.monotonic() + delay >= deadline:
+            raise error
+        time.sleep(delay)
+
+    def _json_call(self, system, user, temperature, max_tokens, on_progress=None, priority="interactive"):
+        """Run a JSON-only Gemini completion and return the parsed object.
+
+        With `on_progress`, the completion is streamed instead and on_progress(partial) is called
+        each time a top-level field or array element completes. `partial` holds the fields
+        parsed so far, with arrays filled in element by element.
+
+        Text-only requests are memoized in the response cache, so a repeat of the same prompt
+        (a double click, a rerun, Back then Continue) is answered instantly. `priority` is the
+        model gate class the call waits in (see PRIORITIES).
+
+        Raises BudgetExhausted (after checking the cache) once a token budget is spent, and
+        trims max_tokens to BUDGET_REDUCED_OUTPUT of itself while one is nearly spent.
+        """
+        cache_key = None
+        if isinstance(user, str):
+            cache_key = self.responses.key(self.model, temperature, system, user)
+            cached = self.responses.get(cache_key)
+            if cached is not None:
+                if on_progress is not None:
+                    on_progress(cached)
+                return cached
+        level = self.budget_level()
+        if level == "exhausted":
+            raise BudgetExhausted("Token budget spent for now; answering locally.")
+        if level == "reduced":
+            max_tokens = int(max_tokens * BUDGET_REDUCED_OUTPUT)
+        request = dict(
+            model=self.model,
+            contents=user,
+            config=genai_types.GenerateContentConfig(
+                system_instruction=system,
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+                response_mime_type="application/json",
+                # Disable "thinking" so the token budget goes to the JSON, not reasoning.
+                thinking_config=genai_types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+        if on_progress is None:
+            out = json.loads(self._generate("json", priority, **request).text)
+        else:
+            parser, partial = JSONStreamParser(), {}
+            for chunk in self._generate_stream("stream", priority, **request):
+                events = parser.feed(chunk)
+                for kind, key, value in events:
+                    if kind == "item":
+                        partial.setdefault(key, []).append(value)
+                    else:
+                        partial[key] = value
+                if events:
+                    on_progress(partial)
+            out = json.loads(parser.text)
+        if cache_key is not None:
+            self.responses.put(cache_key, out)
+        return out
+
+    def _transcribe(self, audio_bytes, mime_type="audio/wav"):
+        """Transcribe audio bytes with Gemini and return the text ("" if none). Raises on failure.
+
+        Makes no Streamlit calls, so it is safe to run on a worker thread. Results are cached by
+        a digest of the audio, so the same recording is never sent twice.
+        """
+        with self.metrics.span("transcribe") as span:
+            check_recording_size(audio_bytes)
+            key = self.transcripts.key(audio_bytes, self.model)
+            text = self.transcripts.get(key)
+            if text is not None:
+                return text
+            if AUDIO_PREPROCESSING:
+                audio_bytes, mime_type = preprocess_audio(audio_bytes, mime_type)
+            resp = self._generate(
+                "transcribe",
+                "interactive",
+                model=self.model,
+                contents=[
+                    "Transcribe this audio to plain text. Return only the transcript, no commentary.",
+                    genai_types.Part.from_bytes(data=audio_bytes, mime_type=mime_type),
+                ],
+                config=genai_types.GenerateContentConfig(
+                    thinking_config=genai_types.ThinkingConfig(thinking_budget=0),
+                ),
+            )
+            text = (resp.text or "").strip()
+            if text:
+                self.transcripts.put(key, text)
+            else:
+                span.outcome = "error"
+            return text
+
+    def transcribe(self, audio_bytes, mime_type="audio/wav"):
+        """Transcribe recorded audio (raw bytes, never written to disk) to text using Gemini."""
+        if not self.client:
+            st.warning("Voice transcription needs the assistant to be connected. "
+                       "Please try again once it is back online.")
+            return None
+
+        try:
+            text = self._transcribe(audio_bytes, mime_type)
+            if text:
+                return text
+
+            st.error("Transcription response had no text.")
+            return None
+        except RecordingTooLarge as e:
+            st.warning(f"That recording is too long to transcribe. {e} Please record a shorter one.")
+            return None
+        except BackendUnavailable:
+            st.warning("The assistant is temporarily unavailable, so your recording could not be "
+                       "transcribed. Please try again shortly.")
+            return None
+        except Exception as e:
+            st.error("Transcription failed.")
+            st.exception(e)
+            return None
+
+    def transcribe_many(self, clips, timeout=TRANSCRIBE_TIMEOUT_S):
+        """Transcribe several recordings at once and return their texts in the same order.
+
+        `clips` holds audio bytes, or None where nothing was recorded. All clips are sent
+        concurrently on the shared worker pool, so the wait is roughly the slowest call rather
+        than the sum. A clip that fails or misses the deadline yields None without affecting
+        the others.
+        """
+        results = [None] * len(clips)
+        if not any(clips):
+            return results
+        if not self.client:
+            st.warning("Voice transcription needs the assistant to be connected. "
+                       "Please try again once it is back online.")
+            return results
+
+        pool = worker_pool()
+        futures = {i: pool.submit(self._transcribe, clip) for i, clip in enumerate(clips) if clip}
+        deadline = time.monotonic() + timeout
+        for i, future in futures.items():
+            try:
+                results[i] = future.result(timeout=max(0.0, deadline - time.monotonic())) or None
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                st.warning(f"Answer {i + 1} took too long to transcribe, so it was left out.")
+            except RecordingTooLarge as e:
+                st.warning(f"Answer {i + 1} was too long to transcribe, so it was left out. {e}")
+            except BackendUnavailable:
+                st.warning(f"Answer {i + 1} was left out while the assistant is temporarily unavailable.")
+            except Exception as e:
+                st.error(f"Transcription failed for answer {i + 1}.")
+                st.exception(e)
+        return results
+
+    def followup_questions(self, text, on_question=None):
+        """Suggest 1-2 short follow-up questions based on what the person just shared.
+
+        Falls back to sensible defaults when the assistant is offline or nothing was shared.
+        If `on_question` is given, the reply is streamed and on_question is called with each
+        question as soon as that question is complete, so work such as speech synthesis can
+        start before the list is returned.
+        """
+        if on_question is None:
+            return self._followup_questions(text)
+
+        streamed = []
+
+        def on_progress(partial):
+            for q in partial.get("questions", [])[len(streamed):2]:
+                q = str(q).strip()
+                streamed.append(q)
+                if q:
+                    on_question(q)
+
+        questions = self._followup_questions(text, on_progress)
+        # Anything not streamed (fallback questions, or a reply cut short) is announced now.
+        for q in questions:
+            if q not in streamed:
+                on_question(q)
+        return questions
+
+    def _followup_questions(self, text, on_progress=None):
+        with self.metrics.span("followup_questions") as span:
+            fallback = list(FALLBACK_QUESTIONS)
+            if not self.client or not (text or "").strip():
+                span.outcome = "fallback"
+                return fallback
+
+            system = (
+                f"{COACH_PERSONA} Based on what the person shared "
+                "in their own words, propose 1 to 2 short, gentle follow-up questions that would help you "
+                "understand their stress better. Make each question specific to what they said, and easy to "
+                "answer out loud. Respond ONLY as a JSON object of the form {\"questions\": [\"...\", \"...\"]}. "
+                "No markdown, no preamble, no medical questions."
+            )
+            user = f"IN THEIR OWN WORDS: {text}"
+            partial = {}
+
+            def track(progress):
+                partial.update(progress)
+                on_progress(progress)
+
+            try:
+                out = self._json_call(system, user, temperature=0.5, max_tokens=256,
+                                      on_progress=track if on_progress else None)
+            except Exception:
+                # Keep any questions that already streamed in (and may already be playing).
+                out = partial
+            questions = [str(q).strip() for q in out.get("questions", []) if str(q).strip()]
+            if not questions:
+                span.outcome = "fallback"
+            return questions[:2] or fallback
+
+    def analyze_text(self, text, draft=None, on_update=None, deadline_s=ANALYSIS_DEADLINE_S, priority="interactive"):
+        """Estimate a stress snapshot from the person's own words (no questionnaire).
+
+        Returns a score (0-100), the factors behind it, relevant stress facts, a short
+        observation, and a practical recommendation. `source` is "assistant" for a model
+        result. When the assistant is offline or the call fails, the local lexicon scorer
+        answers instead (`source` "local"), and with nothing to go on the neutral fallback
+        does (`source` "fallback"). A `draft` (an earlier result for part of the text) is
+        passed along for the model to refine.
+
+        The model is raced against `deadline_s`: if it has not answered by then, the local
+        estimate is returned at once with the still-running request under "late", a future
+        for the model's result, so the caller can swap it in when it lands. Pass None to wait
+        for the model however long it takes (as background work does, at `priority`
+        "background").
+
+        With `on_update`, the reply is streamed and on_update(partial) is called whenever another
+        piece is ready: the score first, then each factor, each fact, the observation and the
+        recommendation. `partial` has the same shape as the result, minus fields not yet seen.
+        Updates are delivered on the calling thread, and only until the deadline.
+        """
+        with self.metrics.span("analyze_text") as span:
+            result = self._analyze_text(text, draft, on_update, deadline_s, priority)
+            if result["source"] != "assistant":
+                span.outcome = "fallback"
+        return result
+
+    def _analyze_text(self, text, draft, on_update, deadline_s, priority):
+        if not (text or "").strip():
+            return fallback_analysis()
+        if not self.client:
+            return self.scorer.analyze(text)
+        if deadline_s is None:
+            try:
+                return self._analyze_remote(text, draft, on_update, priority)
+            except Exception:
+                return self.scorer.analyze(text)
+
+        # The request runs on the worker pool; its streamed pieces come back through a queue so
+        # on_update still runs here, on the script thread.
+        updates = queue.SimpleQueue()
+        job = worker_pool().submit(self._analyze_remote, text, draft, updates.put if on_update else None, priority)
+        deadline = time.monotonic() + deadline_s
+        while not job.done() and time.monotonic() < deadline:
+            try:
+                partial = updates.get(timeout=max(0.0, min(0.05, deadline - time.monotonic())))
+            except queue.Empty:
+                continue
+            on_update(partial)
+        if not job.done():
+            local = self.scorer.analyze(text)
+            local["late"] = job
+            return local
+        while not updates.empty():
+            on_update(updates.get())
+        try:
+            return job.result()
+        except Exception:
+            return self.scorer.analyze(text)
+
+    def _analyze_remote(self, text, draft=None, on_update=None, priority="interactive"):
+        """The model half of analyze_text; raises when the call fails. Safe to run on a worker thread."""
+        system = (
+            f"{COACH_PERSONA} You are NOT a doctor and never "
+            "diagnose. Read what the person shared in their own words and respond ONLY as a JSON object "
+            f"of the form {{{ANALYSIS_FIELDS}}}. {ANALYSIS_RULES}"
+        )
+        user = f"IN THEIR OWN WORDS: {text}"
+        if draft:
+            draft_json = json.dumps({
+                "score": draft["score"],
+                "factors": [{"label": label, "detail": detail} for label, detail in draft["factors"]],
+                "facts": draft["facts"],
+                "observations": draft["observations"],
+                "recommendation": draft["recommendation"],
+            })
+            user += f"\n\nDRAFT ANALYSIS OF THEIR FIRST REFLECTION (refine it with anything new above): {draft_json}"
+        on_progress = None if on_update is None else (lambda partial: on_update(_parse_analysis(partial)))
+        out = self._json_call(system, user, temperature=0.5, max_tokens=800, on_progress=on_progress,
+                              priority=priority)
+        return _complete_analysis(_parse_analysis(out))
+
+    def enrich_guidance(self, intake, result, text=""):
+        """Tailor the observation and recommendation of a questionnaire result.
+
+        The score, factors and facts stay as computed; only the wording of the guidance is
+        personalised. Returns {"observations", "recommendation"}, or None when the assistant
+        is offline or the call fails, so the deterministic guidance simply stays in place.
+        Safe to run on a worker thread; the call waits at background priority.
+        """
+        if not self.client or self.budget_level() != "normal":
+            return None
+        system = (
+            f"{COACH_PERSONA} You are NOT a doctor and never diagnose. The person answered a short "
+            "stress questionnaire and has already been shown the score and factors below. Respond ONLY "
+            'as a JSON object of the form {"observations": "<at most 2 supportive, specific sentences '
+            'reflecting what stands out>", "recommendation": "<exactly 2 short, practical, doable '
+            'sentences>"}. No markdown, no medical claims.'
+        )
+        user = json.dumps({
+            "answers": intake,
+            "score": result["score"],
+            "band": band_for_score(result["score"]),
+            "factors": [label for label, _ in result["factors"]],
+            "in_their_own_words": text,
+        })
+        try:
+            out = self._json_call(system, user, temperature=0.5, max_tokens=300, priority="background")
+        except Exception:
+            return None
+        recommendation = str(out.get("recommendation", "")).strip()
+        if not recommendation:
+            return None
+        return {"observations": str(out.get("observations", "")).strip(), "recommendation": recommendation}
+
+    def ask_from_recording(self, audio_bytes, on_question=None, mime_type="audio/wav"):
+        """Multimodal intake: transcribe the first recording and propose follow-ups in one request.
+
+        Returns (transcript, questions); questions stream to `on_question` like followup_questions.
+        Falls back to the two-step pipeline (transcribe, then followup_questions) if the
+        combined request fails or the assistant is offline.
+        """
+        streamed = []
+
+        def on_progress(partial):
+            for q in partial.get("questions", [])[len(streamed):2]:
+                q = str(q).strip()
+                streamed.append(q)
+                if q and on_question is not None:
+                    on_question(q)
+
+        system = (
+            f"{COACH_PERSONA} The audio is the person describing, in their own words, how they "
+            "have been feeling. First transcribe it exactly as plain text. Then propose 1 to 2 short, "
+            "gentle follow-up questions that would help you understand their stress better, specific "
+            "to what they said and easy to answer out loud. Respond ONLY as a JSON object of the form "
+            '{"transcript": "...", "questions": ["...", "..."]}. No markdown, no medical questions.'
+        )
+        # Over-size recordings go the pipeline route, where transcription reports the problem.
+        if self.client and len(audio_bytes) <= MAX_RECORDING_BYTES:
+            upload, upload_mime = (preprocess_audio(audio_bytes, mime_type) if AUDIO_PREPROCESSING
+                                   else (audio_bytes, mime_type))
+            try:
+                out = self._json_call(system, [genai_types.Part.from_bytes(data=upload, mime_type=upload_mime)],
+                                      temperature=0.3, max_tokens=1024, on_progress=on_progress)
+                text = str(out.get("transcript", "")).strip()
+                questions = [str(q).strip() for q in out.get("questions", []) if str(q).strip()][:2]
+                if text:
+                    self.transcripts.put(self.transcripts.key(audio_bytes, self.model), text)
+                if text and questions:
+                    for q in questions:
+                        if q not in streamed and on_question is not None:
+                            on_question(q)
+                    return text, questions
+            except Exception:
+                pass
+            if any(streamed):
+                # Questions already went out (and may be synthesizing); keep them.
+                return self.transcribe(audio_bytes, mime_type) or "", [q for q in streamed if q]
+
+        text = self.transcribe(audio_bytes, mime_type) or ""
+        return text, (self.followup_questions(text, on_question=on_question) if text else [])
+
+    def analyze_recordings(self, text, questions, clips, on_update=None):
+        """Multimodal analysis: transcribe the follow-up answers and analyze everything in one request.
+
+        `text` is the first reflection, `questions` the follow-ups and `clips` the recorded
+        answers (bytes or None, aligned with `questions`). Returns (answers, result): the
+        answer transcripts (None where nothing was recorded) and an analyze_text-style result.
+        Falls back to transcribe_many + analyze_text if the combined request fails.
+        """
+        if self.client and any(clips) and all(len(clip) <= MAX_RECORDING_BYTES for clip in clips if clip):
+            system = (
+                f"{COACH_PERSONA} You are NOT a doctor and never diagnose. The person first shared "
+                "a reflection in their own words, then answered follow-up questions out loud; each "
+                "recorded answer follows its question. First transcribe every answer exactly (use an "
+                "empty string where there is no recording), then analyze everything they shared. "
+                'Respond ONLY as a JSON object of the form {"answers": ["<transcript>", ...], '
+                f"{ANALYSIS_FIELDS}}}. {ANALYSIS_RULES}"
+            )
+            contents = [f"IN THEIR OWN WORDS: {text}"]
+            for i, (q, clip) in enumerate(zip(questions, clips)):
+                contents.append(f"FOLLOW-UP QUESTION {i + 1}: {q}")
+                if clip:
+                    audio, mime = preprocess_audio(clip) if AUDIO_PREPROCESSING else (clip, "audio/wav")
+                    contents.append(genai_types.Part.from_bytes(data=audio, mime_type=mime))
+                else:
+                    contents.append("(no answer recorded)")
+
+            on_progress = None if on_update is None else (
+                lambda partial: on_update(_parse_analysis({k: v for k, v in partial.items() if k != "answers"})))
+            try:
+                out = self._json_call(system, contents, temperature=0.5, max_tokens=800 + 400 * len(clips),
+                                      on_progress=on_progress)
+                said = list(out.get("answers", []))
+                answers = [
+                    (str(said[i]).strip() or None) if clip and i < len(said) else None
+                    for i, clip in enumerate(clips)
+                ]
+                for clip, answer in zip(clips, answers):
+                    if answer:
+                        self.transcripts.put(self.transcripts.key(clip, self.model), answer)
+                return answers, _complete_analysis(_parse_analysis(out))
+            except Exception:
+                pass  # Fall through to the separate transcription and analysis calls.
+
+        answers = self.transcribe_many(clips)
+        return answers, self.analyze_text(combine_answers(text, questions, answers), on_update=on_update)
+
+
+def fallback_analysis():
+    """The neutral, supportive snapshot used when the assistant is offline or has nothing to go on."""
+    return {
+        "source": "fallback",
+        "score": 50,
+        "factors": [
+            ("Based on what you shared",
+             "The assistant is offline, so this is a general reflection rather than a tailored score."),
+        ],
+        "facts": [
+            "Naming what you feel ('this is stress') already begins to lower its intensity.",
+            "Slow breathing with longer out-breaths than in-breaths signals safety to your nervous system.",
+            "Stress is a normal, adaptive response; the goal is to keep it from staying switched on too long.",
+        ],
+        "observations": "",
+        "recommendation": (
+            "Take three slow breaths and relax your shoulders, then choose one small thing "
+            "you can do in the next hour. Steady, small steps matter more than fixing everything today."
+        ),
+    }
+
+
+def _complete_analysis(parsed):
+    """Turn a parsed model analysis into a full result, filling any gaps from the fallback."""
+    fallback = fallback_analysis()
+    return {
+        "source": "assistant",
+        "score": parsed.get("score", 50),
+        "factors": parsed.get("factors") or fallback["factors"],
+        "facts": parsed.get("facts") or fallback["facts"],
+        "observations": parsed.get("observations", ""),
+        "recommendation": parsed.get("recommendation") or fallback["recommendation"],
+    }
+
+
+def combine_answers(text, questions, answers):
+    """Join the first reflection with each answered follow-up question into one block of text."""
+    parts = [text] if text else []
+    parts += [f"{q} {answer}" for q, answer in zip(questions, answers) if answer]
+    return "\n".join(parts).strip()
+
+
+def _parse_analysis(out):
+    """Normalize a (possibly partial) analysis object from the model; absent fields stay absent."""
+    parsed = {}
+    if "score" in out:
+        parsed["score"] = int(max(0, min(100, round(float(out["score"])))))
+    if "factors" in out:
+        parsed["factors"] = [
+            (str(f.get("label", "")).strip(), str(f.get("detail", "")).strip())
+            for f in out["factors"]
+            if isinstance(f, dict) and str(f.get("label", "")).strip()
+        ][:4]
+    if "facts" in out:
+        parsed["facts"] = [str(x).strip() for x in out["facts"] if str(x).strip()][:4]
+    for key in ("observations", "recommendation"):
+        if key in out:
+            parsed[key] = str(out[key]).strip()
+    return parsed
+
+
+def band_for_score(score):
+    """Map a 0-100 stress score onto the four bands used across the UI."""
+    if score <= 25:
+        return "LOW"
+    elif score <= 50:
+        return "MODERATE"
+    elif score <= 75:
+        return "HIGH"
+    return "SEVERE"
+
+
+# ---------------------- CHECK-IN STATE ----------------------
+@dataclass(slots=True)
+class CheckIn:
+    """One check-in, kept in session state as a single record.
+
+    Recordings are not kept here: each is transcribed (and its transcript cached), then
+    released by release_recordings, so only the words stay for the rest of the session.
+    List fields start as empty tuples and are replaced whole, never appended to.
+    """
+    stage: str = "intake"  # intake -> followup -> done
+    text: str = ""         # the reflection, then combined with the follow-up answers
+    intake: dict | None = None  # questionnaire answers
+    followups: list | tuple = ()
+    followup_audio: list | tuple = ()  # each question read aloud, until analyzed
+    speculative: concurrent.futures.Future | None = None  # see start_speculative_analysis
+    enrichment: tuple | None = None  # (job, deadline); see follow_up_result
+    source: str = ""
+    score: int = 0
+    band: str = ""
+    factors: list | tuple = ()
+    facts: list | tuple = ()
+    observations: str = ""
+    rec: str = ""
+    results_html: "ResultsHTML | None" = None  # see results_html
+
+    @property
+    def done(self):
+        return self.stage == "done"
+
+
+def checkin():
+    """This session's check-in record, started on first use."""
+    if "checkin" not in st.session_state:
+        st.session_state.checkin = CheckIn()
+    return st.session_state.checkin
+
+
+def release_recordings(*keys):
+    """Drop the recorder widgets' uploads under `keys` once their words have been captured.
+
+    Streamlit keeps every upload's bytes for the whole session, even after its widget is gone,
+    so both the widget value and the upload manager's copy are removed. (Only the in-memory
+    manager, Streamlit's default, can drop a single file.)
+    """
+    ctx = get_script_run_ctx()
+    remove_file = getattr(ctx.uploaded_file_mgr, "remove_file", None) if ctx is not None else None
+    released = 0
+    for key in keys:
+        upload = st.session_state.get(key)
+        if upload is None:
+            continue
+        released += len(upload.getbuffer())
+        file_id = getattr(upload, "file_id", None)
+        if remove_file is not None and file_id is not None:
+            remove_file(ctx.session_id, file_id)
+        del st.session_state[key]
+    if released:
+        metrics().count("recording_bytes_released", released)
+
+
+def _footprint(value, seen):
+    """Approximate bytes held by `value` and everything it references, each object counted once."""
+    if id(value) in seen or callable(value):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)  # For an in-memory upload, this includes its buffer.
+    if isinstance(value, dict):
+        size += sum(_footprint(k, seen) + _footprint(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        size += sum(_footprint(v, seen) for v in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(_footprint(getattr(value, name, None), seen) for name in value.__slots__)
+    elif hasattr(value, "__dict__"):
+        size += _footprint(vars(value), seen)
+    return size
+
+
+def session_memory():
+    """Approximate bytes this session keeps in session state, and how much of that is audio."""
+    seen = set()
+    audio = sum(_footprint(clip, seen) for clip in checkin().followup_audio)
+    total = audio
+    for key in st.session_state:
+        value = st.session_state[key]
+        size = _footprint(value, seen)
+        total += size
+        if isinstance(value, io.BytesIO):  # a recording not yet released
+            audio += size
+    return {"bytes": total, "audio_bytes": audio}
+
+
+# ---------------------- SPECULATIVE ANALYSIS ----------------------
+# Opt-in: start analyzing the first reflection while the person answers the follow-ups.
+SPECULATIVE_ANALYSIS = get_flag("SPECULATIVE_ANALYSIS", False)
+# Follow-up answers with fewer meaningful words than this reuse the speculative result as is.
+SPECULATIVE_MIN_NEW_WORDS = 4
+FILLER_WORDS = {
+    "a", "an", "and", "the", "i", "i'm", "im", "it", "its", "it's", "is", "was", "to", "of", "so",
+    "um", "uh", "er", "like", "yes", "yeah", "no", "nope", "not", "really", "nothing", "much",
+    "don't", "dont", "know", "maybe", "just", "ok", "okay", "fine", "sure", "well",
+}
+
+
+def start_speculative_analysis(assistant, text):
+    """Begin analyzing the first reflection in the background (when enabled and online)."""
+    cancel_speculative_analysis()
+    if (SPECULATIVE_ANALYSIS and assistant.client and (text or "").strip()
+            and assistant.budget_level() == "normal"):
+        checkin().speculative = background_pool().submit(
+            assistant.analyze_text, text, deadline_s=None, priority="background")
+
+
+def cancel_speculative_analysis():
+    state = checkin()
+    job, state.speculative = state.speculative, None
+    if job is not None:
+        job.cancel()
+
+
+def _adds_substance(answers):
+    """True when the follow-up answers say something beyond filler like "no, not really"."""
+    words = re.findall(r"[a-z']+", " ".join(a for a in answers if a).lower())
+    return sum(w not in FILLER_WORDS for w in words) >= SPECULATIVE_MIN_NEW_WORDS
+
+
+def resolve_analysis(assistant, text, answers, on_update=None):
+    """Analyze the combined text, reusing or refining a speculative result where there is one.
+
+    Insubstantial answers reuse the speculative result unchanged (usually already finished,
+    and otherwise awaited only up to ANALYSIS_DEADLINE_S, like analyze_text).
+    Otherwise a finished speculative result is handed to the model as a draft to refine, and
+    an unfinished one is dropped in favour of analyzing the full text straight away.
+    """
+    state = checkin()
+    job, state.speculative = state.speculative, None
+    if job is None:
+        return assistant.analyze_text(text, on_update=on_update)
+    if not _adds_substance(answers):
+        try:
+            draft = job.result(timeout=ANALYSIS_DEADLINE_S)
+        except concurrent.futures.TimeoutError:
+            # Still running: answer with the local estimate and let the speculative result follow.
+            local = assistant.scorer.analyze(text)
+            local["late"] = job
+            return local
+        except Exception:
+            draft = None
+        if draft and draft["source"] == "assistant":
+            if on_update is not None:
+                on_update(draft)
+            return draft
+        return assistant.analyze_text(text, on_update=on_update)
+    draft = None
+    if job.done() and not job.cancelled() and job.exception() is None:
+        draft = job.result()
+    if draft and draft["source"] == "assistant":
+        return assistant.analyze_text(text, draft=draft, on_update=on_update)
+    job.cancel()
+    return assistant.analyze_text(text, on_update=on_update)
+
+
+# ---------------------- QUESTIONNAIRE ENRICHMENT ----------------------
+# A questionnaire result is shown at once; the assistant then tailors its guidance in the
+# background and the Results tab swaps it in when ready (or keeps the default if it never is).
+# A local estimate from an analysis that missed its deadline is replaced the same way.
+CHECKIN_MODES = ("Voice reflection", "Quick questionnaire")
+QUESTIONNAIRE_ENRICHMENT = get_flag("QUESTIONNAIRE_ENRICHMENT", True)
+ENRICHMENT_TIMEOUT_S = 30
+ENRICHMENT_POLL_S = 1.0
+
+
+def start_enrichment(assistant, intake, result, text=""):
+    """Ask the assistant to tailor a questionnaire result's guidance, on the worker pool."""
+    cancel_enrichment()
+    if QUESTIONNAIRE_ENRICHMENT and assistant.client and assistant.budget_level() == "normal":
+        follow_up_result(background_pool().submit(assistant.enrich_guidance, intake, result, text))
+
+
+def follow_up_result(job):
+    """Replace the stored result's fields with whatever `job` returns, once it finishes."""
+    cancel_enrichment()
+    checkin().enrichment = (job, time.monotonic() + ENRICHMENT_TIMEOUT_S)
+
+
+def cancel_enrichment():
+    state = checkin()
+    pending, state.enrichment = state.enrichment, None
+    if pending is not None:
+        pending[0].cancel()
+
+
+def collect_enrichment():
+    """Apply finished enrichment to the stored result; True once the pending job is settled.
+
+    A job that fails or runs past ENRICHMENT_TIMEOUT_S is dropped, keeping the default guidance.
+    """
+    state = checkin()
+    pending = state.enrichment
+    if pending is None:
+        return False
+    job, deadline = pending
+    if not job.done():
+        if time.monotonic() > deadline:
+            cancel_enrichment()
+            return True
+        return False
+    state.enrichment = None
+    try:
+        guidance = job.result()
+    except Exception:
+        guidance = None
+    if guidance and guidance.get("source") in ("local", "fallback"):
+        guidance = None  # The model failed after all; the estimate already shown stays.
+    if guidance:
+        update_result(guidance)
+    return True
+
+
+def store_result(result):
+    """Keep an analysis (from any source) as the session's finished check-in.
+
+    A local estimate that still has the model's result on the way ("late") is replaced by it
+    once it lands.
+    """
+    update_result(result)
+    state = checkin()
+    state.stage = "done"
+    state.followup_audio = ()  # The questions are not played again.
+    if "late" in result:
+        follow_up_result(result["late"])
+
+
+def update_result(fields):
+    """Overwrite the stored result with whichever analysis fields `fields` has."""
+    state = checkin()
+    state.results_html = None
+    if "score" in fields:
+        state.score = fields["score"]
+        state.band = band_for_score(fields["score"])
+    for name, attr in (("source", "source"), ("factors", "factors"), ("facts", "facts"),
+                       ("observations", "observations"), ("recommendation", "rec")):
+        if name in fields:
+            setattr(state, attr, fields[name])
+
+
+# ---------------------- TEXT-TO-SPEECH CACHE ----------------------
+TTS_LANG = "en"
+TTS_TLD = "com"  # gTTS accent ("voice"), selected by the Google Translate domain
+TTS_MEMORY_BYTES = 16 * 1024 * 1024
+TTS_DISK_BYTES = 256 * 1024 * 1024
+TTS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "stress-app-tts")
+# Seconds to wait for follow-up question audio before showing the question without it.
+TTS_TIMEOUT_S = 20
+# Seconds each gTTS HTTP request may take (gTTS waits forever by default), so a hung synthesis
+# gives its thread back instead of holding it for good.
+TTS_REQUEST_TIMEOUT_S = 10
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized speech with a memory tier and a disk tier.
+
+    Entries are keyed by a hash of (text, language, voice). The memory tier holds any clip, within
+    its byte budget, least recently used first out. The disk tier only holds the fixed phrases
+    in `persist` (nothing a person said or was told about themselves is written to disk). It
+    survives process restarts and is shared by every worker on the machine: lookups fall back to
+    the file when a clip is not in this process's index, and the byte budget is applied to the
+    directory as found on disk, whichever workers wrote it.
+    """
+
+    def __init__(self, directory, memory_bytes, disk_bytes, persist=()):
+        self.memory = LRUCache(max_bytes=memory_bytes)
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.persist = {self.key(text, TTS_LANG, TTS_TLD) for text in persist}
+        self._lock = threading.Lock()
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_total = 0
+        self.disk_hits = 0
+        self.syntheses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def key(text, lang, tld):
+        return hashlib.sha256(f"{lang}\0{tld}\0{text}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _scan(self):
+        """Rebuild the disk index from the directory, oldest first by modification time.
+
+        Clips of anything outside `persist` (left by older versions) are removed.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".mp3"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if name[:-4] not in self.persist:
+                    os.remove(path)
+                    continue
+                info = os.stat(path)
+            except OSError:
+                continue  # Removed by another worker meanwhile.
+            entries.append((info.st_mtime, name[:-4], info.st_size))
+        with self._lock:
+            self._disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+            self._disk_total = sum(self._disk.values())
+
+    def get_or_synthesize(self, text, lang=TTS_LANG, tld=TTS_TLD):
+        """Return MP3 bytes for the text, synthesizing with gTTS only on a miss in both tiers."""
+        key = self.key(text, lang, tld)
+        audio = self.memory.get(key)
+        if audio is not None:
+            return audio
+
+        persist = key in self.persist
+        audio = self._read_disk(key) if persist else None
+        if audio is None:
+            buf = io.BytesIO()
+            gtts.gTTS(text, lang=lang, tld=tld, timeout=TTS_REQUEST_TIMEOUT_S).write_to_fp(buf)
+            audio = buf.getvalue()
+            with self._lock:
+                self.syntheses += 1
+            if persist:
+                self._write_disk(key, audio)
+        self.memory.put(key, audio)
+        return audio
+
+    def _read_disk(self, key):
+        # Not indexed here does not mean absent: another worker may have written it since.
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+            os.utime(self._path(key))  # keep on-disk recency in step for the next scan
+        except OSError:
+            with self._lock:
+                self._disk_total -= self._disk.pop(key, 0)
+            return None
+        with self._lock:
+            self._disk_total += len(audio) - self._disk.pop(key, 0)
+            self._disk[key] = len(audio)
+            self.disk_hits += 1
+        return audio
+
+    def _write_disk(self, key, audio):
+        path = self._path(key)
+        try:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+            # Other workers write to the same directory: budget what is actually there.
+            self._scan()
+        except OSError:
+            return  # Disk tier is best-effort; the memory tier still holds the clip.
+        with self._lock:
+            evict = []
+            while self._disk_total > self.disk_bytes and len(self._disk) > 1:
+                old, size = self._disk.popitem(last=False)
+                self._disk_total -= size
+                evict.append(old)
+        for old in evict:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def stats(self):
+        mem = self.memory.stats()
+        lookups = mem["hits"] + mem["misses"]
+        hits = mem["hits"] + self.disk_hits
+        return {
+            "memory_hits": mem["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.syntheses,
+            "memory_bytes": mem["bytes"],
+            "disk_bytes": self._disk_total,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+@st.cache_resource
+def tts_cache():
+    """The process-wide TTS cache (its disk tier, for the fixed phrases only, is shared with other
+    workers on this machine)."""
+    return TTSCache(TTS_CACHE_DIR, TTS_MEMORY_BYTES, TTS_DISK_BYTES,
+                    persist=(*FALLBACK_QUESTIONS, *BAND_GUIDANCE.values()))
+
+
+def _synthesize(cache, registry, text):
+    with registry.span("synth_speech") as span:
+        try:
+            return cache.get_or_synthesize(text)
+        except Exception:
+            span.outcome = "error"
+            return None
+
+
+def synth_speech(text):
+    """Render text to MP3 bytes with gTTS (through the TTS cache) so it can be played aloud; None on failure."""
+    return _synthesize(tts_cache(), metrics(), text)
+
+
+def synth_speech_async(text):
+    """Start synth_speech on the worker pool and return a future for the MP3 bytes (or None)."""
+    # Look the cache up here: cached resources are resolved on the script thread, not the worker.
+    return worker_pool().submit(_synthesize, tts_cache(), metrics(), text)
+
+
+@st.cache_resource
+def prewarm_fallback_speech():
+    """Synthesize the fallback follow-up questions and default guidance once per process, in the background."""
+    return [synth_speech_async(q) for q in (*FALLBACK_QUESTIONS, *BAND_GUIDANCE.values())]
+
+
+def followups_with_speech(assistant, text=None, audio_bytes=None):
+    """Generate follow-up questions and their speech, overlapping the two.
+
+    Pass the person's `text`, or (multimodal mode) the raw `audio_bytes` of their recording to
+    be transcribed in the same request. Each question's synthesis starts on the worker pool as
+    soon as that question is available, and all clips are synthesized in parallel. Returns
+    (text, questions, audio) where audio holds MP3 bytes, or None for a clip that failed or ran
+    past TTS_TIMEOUT_S.
+    """
+    jobs = []
+
+    def on_question(q):
+        jobs.append(synth_speech_async(q))
+
+    if audio_bytes is not None:
+        text, questions = assistant.ask_from_recording(audio_bytes, on_question=on_question)
+    else:
+        questions = assistant.followup_questions(text, on_question=on_question)
+    deadline = time.monotonic() + TTS_TIMEOUT_S
+    audio = []
+    for job in jobs:
+        try:
+            audio.append(job.result(timeout=max(0.0, deadline - time.monotonic())))
+        except concurrent.futures.TimeoutError:
+            audio.append(None)
+    return text, questions, audio
+
+
+# ---------------------- RESULTS MARKUP ----------------------
+# The results page's markup, minified once at import and filled in with str.format.
+SECTION_TITLE_TEMPLATE = '<div class="section-title">{}</div>'
+SNAPSHOT_TEMPLATE = _minify("""
+<div class="info-box">
+<h3>Your Stress Snapshot</h3>
+<div style="display:flex; align-items:center; gap:0.6rem;">
+    <span class="stress-score-num">{score}</span>
+    <span style="color:#64748b; font-weight:600;">/ 100</span>
+    <span class="band-badge" style="background:{color}; margin-left:auto;">{band}</span>
+</div>
+<div class="meter-track"><div class="meter-marker" style="left:{score}%;"></div></div>
+<div class="meter-scale"><span>Calm</span><span>Moderate</span><span>High</span></div>
+<p style="margin-top:0.9rem; line-height:1.6;">{summary}</p>
+</div>
+""")
+FACTOR_TEMPLATE = '<div class="fact-item"><strong>{}</strong><br><span style="color:#64748b;">{}</span></div>'
+FACT_TEMPLATE = '<div class="fact-item">{}</div>'
+OWN_WORDS_TEMPLATE = _minify("""
+<div class="info-box">
+<p style="font-size:1.05rem; line-height:1.6; font-style:italic;">{}</p>
+</div>
+""")
+OBSERVATIONS_TEMPLATE = _minify("""
+<div class="info-box">
+<h3>What We Noticed</h3>
+<p style="line-height:1.6;">{}</p>
+</div>
+""")
+GUIDANCE_TEMPLATE = _minify("""
+<div class="result-box">
+<h3>Your Personalized Guidance</h3>
+<p style="font-size:1.2rem; line-height:1.7;">{}</p>
+<div style="font-size:0.9rem; opacity:0.9; margin-top:0.5rem;">
+You do not have to fix everything today. Small steps count.
+</div>
+</div>
+""")
+
+
+def snapshot_html(score, band):
+    """The stress snapshot card: score, band badge, meter and band summary."""
+    return SNAPSHOT_TEMPLATE.format(score=score, band=band, color=BAND_COLORS[band], summary=BAND_SUMMARY[band])
+
+
+def factors_html(factors):
+    return "".join(FACTOR_TEMPLATE.format(label, detail) for label, detail in factors)
+
+
+def facts_html(facts):
+    return "".join(FACT_TEMPLATE.format(f) for f in facts)
+
+
+def guidance_html(rec):
+    return GUIDANCE_TEMPLATE.format(rec)
+
+
+@dataclass(frozen=True)
+class ResultsHTML:
+    """The finished results page's markup: the summary above the guidance, and the guidance."""
+    summary: str   # snapshot, factors and the person's own words
+    guidance: str  # observations, stress facts and the recommendation
+
+
+def results_html():
+    """The stored result's page markup, built once per result and kept until the result changes."""
+    state = checkin()
+    html = state.results_html
+    if html is None:
+        summary = [snapshot_html(state.score, state.band)]
+        if state.factors:
+            summary += [SECTION_TITLE_TEMPLATE.format("What Is Driving This"), factors_html(state.factors)]
+        if state.text:
+            summary += [SECTION_TITLE_TEMPLATE.format("In Your Own Words"), OWN_WORDS_TEMPLATE.format(state.text)]
+        guidance = [OBSERVATIONS_TEMPLATE.format(state.observations)] if state.observations else []
+        guidance += [SECTION_TITLE_TEMPLATE.format("Stress Facts For You"), facts_html(state.facts),
+                     guidance_html(state.rec)]
+        html = state.results_html = ResultsHTML("".join(summary), "".join(guidance))
+    return html